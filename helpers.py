@@ -1,19 +1,30 @@
 from load_variables import *
+import aiohttp
+import aiohttp.payload
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
 import discord
 import hashlib
-import html
 import io
 import json
 import logging
 import magic
-import math
 import os
 import PIL.Image
 import praw
+import random
 import re
 import requests
+import requests.adapters
+import sqlite3
+import tempfile
+import threading
 import time
+import typing
 import urllib.parse
+import xml.etree.ElementTree
 
 class LoggingHelper:
     def __init__(self) -> None:
@@ -56,92 +67,731 @@ class LoggingHelper:
     def error(self, prefix:str, message:str) -> None:
         self.__logger.error(f"{prefix} - {message}")
 
+class Database:
+    '''Thread-safe handle on the local SQLite state database.'''
+    def __init__(self, logger:LoggingHelper, path:str=STATE_DATABASE) -> None:
+        '''Requires an existing LoggingHelper object.'''
+        self.__logger = logger
+        self.__lock = threading.RLock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL keeps every committed transaction intact if the process is killed mid-write.
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__logger.info("Database", f"Opened state database at {path}.")
+
+    def execute(self, query:str, parameters:tuple|dict=()) -> list[tuple]:
+        with self.__lock:
+            return self.__connection.execute(query, parameters).fetchall()
+
+    def executemany(self, query:str, parameters:list) -> None:
+        with self.transaction() as connection:
+            connection.executemany(query, parameters)
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        '''Runs the enclosed statements atomically, rolling back on any exception.'''
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.__connection
+            except BaseException:
+                self.__connection.execute("ROLLBACK")
+                raise
+            else:
+                self.__connection.execute("COMMIT")
+
+class PostStore:
+    '''Post IDs and their solving status, backed by the state database.'''
+    def __init__(self, logger:LoggingHelper, database:Database) -> None:
+        '''Requires existing LoggingHelper and Database objects.'''
+        self.__logger = logger
+        self.__database = database
+        self.__database.execute("CREATE TABLE IF NOT EXISTS posts (post_id TEXT PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL)")
+        # Retry bookkeeping came later, older databases get the columns added in place.
+        columns = {row[1] for row in self.__database.execute("PRAGMA table_info(posts)")}
+        for column, definition in [("attempts", "INTEGER NOT NULL DEFAULT 0"), ("last_error", "TEXT"), ("next_attempt_at", "REAL")]:
+            if column not in columns:
+                self.__database.execute(f"ALTER TABLE posts ADD COLUMN {column} {definition}")
+        self.__database.execute("DROP INDEX IF EXISTS posts_status")
+        self.__database.execute("CREATE INDEX IF NOT EXISTS posts_queue ON posts (status, attempts, post_id)")
+        self.__database.execute("CREATE INDEX IF NOT EXISTS posts_retry ON posts (status, next_attempt_at)")
+        self.__database.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def __contains__(self, post_id:str) -> bool:
+        return bool(self.__database.execute("SELECT 1 FROM posts WHERE post_id = ?", (post_id,)))
+
+    def migrate_text_files(self) -> None:
+        '''One-time import of the old pending/processed/failed text files and saved posts cursor.'''
+        if os.path.isfile("saved_cursor.txt"):
+            with open("saved_cursor.txt", "r", encoding="utf-16") as input_file:
+                cursor = input_file.read().strip()
+            if cursor:
+                self.__database.execute("INSERT OR IGNORE INTO sync_state VALUES ('saved_cursor', ?)", (cursor,))
+            os.replace("saved_cursor.txt", "saved_cursor.txt.migrated")
+            self.__logger.info("Database", "Migrated saved posts cursor from saved_cursor.txt.")
+        # Earlier entries win, a post found in processed_posts.txt stays processed.
+        legacy_files = [
+            ("processed_posts.txt", "processed"),
+            ("failed_posts.txt", "failed"),
+            ("pending_posts.txt", "pending")
+        ]
+        legacy_files = [(file, status) for file, status in legacy_files if os.path.isfile(file)]
+        if not legacy_files:
+            return
+        now = time.time()
+        with self.__database.transaction() as connection:
+            for file, status in legacy_files:
+                with open(file, "r", encoding="utf-16") as input_file:
+                    post_ids = [item.strip() for item in input_file.readlines() if item.strip()]
+                if status == "failed":
+                    # Old failures count as one attempt, their retries spread over RETRY_POST_DELAY instead of all coming due at once.
+                    rows = [(post_id, status, now, 1, now + RETRY_POST_DELAY * (ix+1) / len(post_ids)) for ix, post_id in enumerate(post_ids)]
+                else:
+                    rows = [(post_id, status, now, 0, None) for post_id in post_ids]
+                connection.executemany("INSERT OR IGNORE INTO posts (post_id, status, updated_at, attempts, next_attempt_at) VALUES (?, ?, ?, ?, ?)", rows)
+                self.__logger.info("Database", f"Migrated {len(post_ids)} posts from {file}.")
+        for file, _ in legacy_files:
+            os.replace(file, f"{file}.migrated")
+
+    def recover(self) -> None:
+        '''Returns posts left active by an interrupted run to pending.'''
+        with self.__database.transaction() as connection:
+            recovered = connection.execute("UPDATE posts SET status = 'pending', updated_at = ? WHERE status = 'active'", (time.time(),)).rowcount
+        if recovered:
+            self.__logger.info("Database", f"Recovered {recovered} interrupted posts back to pending.")
+
+    def add_pending(self, post_ids:list[str], cursor:str|None=None) -> None:
+        '''Queues new posts, moving the saved posts cursor in the same transaction if given.
+        A sync interrupted before this point is simply fetched again from the old cursor.'''
+        now = time.time()
+        with self.__database.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO posts (post_id, status, updated_at) VALUES (?, 'pending', ?)", [(post_id, now) for post_id in post_ids])
+            if cursor is not None:
+                connection.execute("INSERT OR REPLACE INTO sync_state VALUES ('saved_cursor', ?)", (cursor,))
+        if cursor is not None:
+            self.__logger.debug("Database", f"Saved posts cursor moved to {cursor}.")
+
+    def saved_cursor(self) -> str|None:
+        '''Newest saved post seen by the last sync, None before the first one.'''
+        rows = self.__database.execute("SELECT value FROM sync_state WHERE key = 'saved_cursor'")
+        return rows[0][0] if rows else None
+
+    def claim_next(self) -> str|None:
+        '''Marks the next pending post active and returns its ID, None if nothing is pending.
+        Fresh posts go first, retries follow in order of how often they failed.'''
+        with self.__database.transaction() as connection:
+            row = connection.execute("SELECT post_id FROM posts WHERE status = 'pending' ORDER BY attempts, post_id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE posts SET status = 'active', updated_at = ? WHERE post_id = ?", (time.time(), row[0]))
+            return row[0]
+
+    def upcoming(self, limit:int) -> list[str]:
+        return [row[0] for row in self.__database.execute("SELECT post_id FROM posts WHERE status = 'pending' ORDER BY attempts, post_id LIMIT ?", (limit,))]
+
+    def mark(self, post_id:str, status:str) -> None:
+        self.__database.execute("UPDATE posts SET status = ?, updated_at = ? WHERE post_id = ?", (status, time.time(), post_id))
+
+    def fail(self, post_id:str, error:str, permanent:bool=False) -> str:
+        '''Records a failed attempt and schedules the next one, doubling the delay each time.
+        After RETRY_POST_ATTEMPTS attempts, or on a permanent error, the post is moved to "dead".
+        Returns the new status.'''
+        now = time.time()
+        with self.__database.transaction() as connection:
+            row = connection.execute("SELECT attempts FROM posts WHERE post_id = ?", (post_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            status = "dead" if permanent or attempts >= RETRY_POST_ATTEMPTS else "failed"
+            next_attempt_at = now + RETRY_POST_DELAY * 2**(attempts-1) if status == "failed" else None
+            connection.execute("UPDATE posts SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE post_id = ?", (status, attempts, error, next_attempt_at, now, post_id))
+        return status
+
+    def requeue_due(self) -> int:
+        '''Moves failed posts whose next attempt is due back to pending.'''
+        now = time.time()
+        with self.__database.transaction() as connection:
+            return connection.execute("UPDATE posts SET status = 'pending', updated_at = ? WHERE status = 'failed' AND COALESCE(next_attempt_at, 0) <= ?", (now, now)).rowcount
+
+    def count(self, status:str) -> int:
+        return self.__database.execute("SELECT COUNT(*) FROM posts WHERE status = ?", (status,))[0][0]
+
+class HashStore:
+    '''Content hashes of delivered media and the post that delivered them, backed by the state database.
+    Each destination chat keeps its own tables under a scope, the default chat uses the unscoped ones.'''
+    def __init__(self, logger:LoggingHelper, database:Database, scope:str|None=None) -> None:
+        '''Requires existing LoggingHelper and Database objects.'''
+        self.__logger = logger
+        self.__database = database
+        suffix = "" if scope is None else "_" + re.sub(r"\W", "_", scope.replace("-", "m"))
+        self.__hash_table = f"hashes{suffix}"
+        self.__url_table = f"hash_urls{suffix}"
+        # Digests are kept as raw 64-byte sha512 blobs, half the size of the hex form.
+        self.__database.execute(f"CREATE TABLE IF NOT EXISTS {self.__hash_table} (hash BLOB PRIMARY KEY, post_id TEXT NOT NULL) WITHOUT ROWID")
+        self.__database.execute(f"CREATE TABLE IF NOT EXISTS {self.__url_table} (url TEXT PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID")
+
+    def get(self, hash:str) -> str|None:
+        '''Returns the post that delivered the hash, None if it is new.'''
+        rows = self.__database.execute(f"SELECT post_id FROM {self.__hash_table} WHERE hash = ?", (bytes.fromhex(hash),))
+        return rows[0][0] if rows else None
+
+    def add(self, hash_list:list[str], post_id:str) -> None:
+        self.__database.executemany(f"INSERT OR REPLACE INTO {self.__hash_table} VALUES (?, ?)", [(bytes.fromhex(hash), post_id) for hash in hash_list])
+
+    def get_url(self, url:str) -> str|None:
+        '''Returns the post that delivered the media behind a URL, None if the URL is unknown.'''
+        rows = self.__database.execute(f"SELECT post_id FROM {self.__url_table} JOIN {self.__hash_table} ON {self.__url_table}.hash = {self.__hash_table}.hash WHERE url = ?", (self.__canonical(url),))
+        return rows[0][0] if rows else None
+
+    def add_urls(self, url_list:list[str], hash:str) -> None:
+        self.__database.executemany(f"INSERT OR REPLACE INTO {self.__url_table} VALUES (?, ?)", [(self.__canonical(url), bytes.fromhex(hash)) for url in url_list])
+
+    def __canonical(self, url:str) -> str:
+        # Scheme, host and a leading www. do not change the resource, the query can.
+        parts = urllib.parse.urlsplit(url)
+        host = parts.netloc.lower().removeprefix("www.")
+        return urllib.parse.urlunsplit(("https", host, parts.path, parts.query, ""))
+
+    def migrate_text_file(self) -> None:
+        '''One-time import of the old hashes.txt.'''
+        if os.path.isfile("hashes.txt") is False:
+            return
+        with open("hashes.txt", "r", encoding="utf-16") as input_file:
+            entries = [item.strip().split(":") for item in input_file.readlines() if item.strip()]
+        self.__database.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?)", [(bytes.fromhex(hash), post_id) for post_id, hash in entries])
+        os.replace("hashes.txt", "hashes.txt.migrated")
+        self.__logger.info("Database", f"Migrated {len(entries)} hashes from hashes.txt.")
+
+class FileIdStore:
+    '''Telegram file_ids of uploaded media by content hash and media type, backed by the state database.
+    Any chat the bot posts to accepts them, so media is uploaded once however often it is sent.'''
+    def __init__(self, logger:LoggingHelper, database:Database) -> None:
+        '''Requires existing LoggingHelper and Database objects.'''
+        self.__logger = logger
+        self.__database = database
+        self.__database.execute("CREATE TABLE IF NOT EXISTS file_ids (hash BLOB NOT NULL, media_type TEXT NOT NULL, file_id TEXT NOT NULL, file_unique_id TEXT NOT NULL, PRIMARY KEY (hash, media_type)) WITHOUT ROWID")
+
+    def get(self, hash:str, media_type:str) -> str|None:
+        '''Returns the file_id the media was uploaded as, None if it never was.'''
+        rows = self.__database.execute("SELECT file_id FROM file_ids WHERE hash = ? AND media_type = ?", (bytes.fromhex(hash), media_type))
+        return rows[0][0] if rows else None
+
+    def add(self, entries:list[tuple[str, str, str, str]]) -> None:
+        '''Stores (hash, media_type, file_id, file_unique_id) entries.'''
+        self.__database.executemany("INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?, ?)", [(bytes.fromhex(hash), media_type, file_id, file_unique_id) for hash, media_type, file_id, file_unique_id in entries])
+
+    def forget(self, hash:str, media_type:str) -> None:
+        self.__database.execute("DELETE FROM file_ids WHERE hash = ? AND media_type = ?", (bytes.fromhex(hash), media_type))
+
+class ResolveCache:
+    '''Media URLs that scraped source pages resolved to, kept for RESOLVE_TTL seconds in the state database.'''
+    def __init__(self, logger:LoggingHelper, database:Database, ttl:int=RESOLVE_TTL) -> None:
+        '''Requires existing LoggingHelper and Database objects.'''
+        self.__logger = logger
+        self.__database = database
+        self.__ttl = ttl
+        self.__database.execute("CREATE TABLE IF NOT EXISTS resolved_urls (source_url TEXT PRIMARY KEY, media_url TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self.__database.execute("DELETE FROM resolved_urls WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, source_url:str) -> str|None:
+        rows = self.__database.execute("SELECT media_url FROM resolved_urls WHERE source_url = ? AND expires_at > ?", (source_url, time.time()))
+        if rows:
+            self.__logger.debug("Telegram", "Using cached resolved media URL.")
+        return rows[0][0] if rows else None
+
+    def put(self, source_url:str, media_url:str) -> None:
+        if self.__ttl > 0:
+            self.__database.execute("INSERT OR REPLACE INTO resolved_urls VALUES (?, ?, ?)", (source_url, media_url, time.time() + self.__ttl))
+
+class ProgressStore:
+    '''Media items already delivered for posts that are not finished yet, backed by the state database.
+    Checkpoints of a destination chat other than the default are kept under post_id@scope.'''
+    def __init__(self, logger:LoggingHelper, database:Database, scope:str|None=None) -> None:
+        '''Requires existing LoggingHelper and Database objects.'''
+        self.__logger = logger
+        self.__database = database
+        self.__suffix = "" if scope is None else f"@{scope}"
+        self.__database.execute("CREATE TABLE IF NOT EXISTS post_progress (post_id TEXT NOT NULL, url TEXT NOT NULL, PRIMARY KEY (post_id, url)) WITHOUT ROWID")
+
+    def delivered(self, post_id:str) -> set[str]:
+        return {row[0] for row in self.__database.execute("SELECT url FROM post_progress WHERE post_id = ?", (post_id + self.__suffix,))}
+
+    def record(self, post_id:str, url_list:list[str]) -> None:
+        self.__database.executemany("INSERT OR IGNORE INTO post_progress VALUES (?, ?)", [(post_id + self.__suffix, url) for url in url_list])
+        self.__logger.debug("Database", f"Checkpointed {len(url_list)} delivered items for post {post_id + self.__suffix}.")
+
+    def clear(self, post_id:str) -> None:
+        self.__database.execute("DELETE FROM post_progress WHERE post_id = ?", (post_id + self.__suffix,))
+
+class Download:
+    '''Outcome of RequestsHelper.download, payload lives in a spooled temporary file or the media cache.
+    Expected size is the length the server declared for the body, None when it did not.'''
+    def __init__(self, url:str, final_url:str, content_type:str, file:typing.BinaryIO|None, size:int, hash:str, head:bytes, too_large:bool=False, expected_size:int|None=None) -> None:
+        self.url = url
+        self.final_url = final_url
+        self.content_type = content_type
+        self.file = file
+        self.size = size
+        self.hash = hash
+        self.head = head
+        self.too_large = too_large
+        self.expected_size = expected_size
+
+class DownloadSpool:
+    '''Collects a streamed body into a spooled temporary file, hashing and keeping the head on the way.
+    Both engines write through it, so the size cap and the resulting Download are the same.'''
+    def __init__(self, resource_url:str, max_bytes:int=DOWNLOAD_SIZE_CAP, expected_size:int|None=None) -> None:
+        self.__resource_url = resource_url
+        self.__max_bytes = max_bytes
+        self.__expected_size = expected_size
+        self.__file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+        self.__digest = hashlib.sha512()
+        self.__head = b""
+        self.size = 0
+
+    @staticmethod
+    def expected_size(headers:typing.Mapping[str, str]) -> int|None:
+        '''Declared length of the body as it will be read, None when unknown.
+        Encoded bodies are decoded on the way in, their Content-Length does not apply.'''
+        declared_size = headers.get("Content-Length")
+        if declared_size is None or not declared_size.isdigit() or headers.get("Content-Encoding", "identity").lower() != "identity":
+            return None
+        return int(declared_size)
+
+    def write(self, chunk:bytes) -> bool:
+        '''Appends a chunk, False once the cap is exceeded and nothing more should be read.'''
+        self.size += len(chunk)
+        if self.size > self.__max_bytes:
+            return False
+        if len(self.__head) < MIME_SNIFF_BYTES:
+            self.__head += chunk[:MIME_SNIFF_BYTES-len(self.__head)]
+        self.__digest.update(chunk)
+        self.__file.write(chunk)
+        return True
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def too_large(self, final_url:str, content_type:str) -> Download:
+        self.close()
+        return Download(self.__resource_url, final_url, content_type, None, self.size, "", self.__head, too_large=True)
+
+    def result(self, final_url:str, content_type:str) -> Download:
+        '''The complete download, raises IOError when the body ended short of or past its declared length.'''
+        if self.__expected_size is not None and self.size != self.__expected_size:
+            self.close()
+            raise IOError(f"Body of {self.size} bytes does not match its declared {self.__expected_size} bytes.")
+        self.__file.seek(0)
+        return Download(self.__resource_url, final_url, content_type, self.__file, self.size, self.__digest.hexdigest(), self.__head, expected_size=self.__expected_size)
+
+class MultipartStream(io.RawIOBase):
+    '''multipart/form-data body read part by part from bytes, memoryviews and file objects.
+    Its length is known up front, so requests sends a Content-Length and streams it a block at a time
+    instead of assembling the whole body in memory.'''
+    def __init__(self, files:dict, data:dict|None=None) -> None:
+        super().__init__()
+        self.boundary = os.urandom(16).hex()
+        self.__parts = []
+        for key, value in (data or {}).items():
+            self.__add(self.__header(key), memoryview(str(value).encode()))
+        for key, value in files.items():
+            filename, payload, content_type = (*value, None)[:3] if isinstance(value, tuple) else (key, value, None)
+            if payload is None:
+                continue
+            if not hasattr(payload, "read"):
+                payload = memoryview(payload if isinstance(payload, (bytes, bytearray, memoryview)) else str(payload).encode())
+            self.__add(self.__header(key, filename, content_type or "application/octet-stream"), payload)
+        self.__parts.append((memoryview(f"--{self.boundary}--\r\n".encode()), 0))
+        self.__length = 0
+        for part, _ in self.__parts:
+            self.__length += part.nbytes if isinstance(part, memoryview) else part.seek(0, os.SEEK_END)
+        self.seek(0)
+
+    def __header(self, name:str, filename:str|None=None, content_type:str|None=None) -> memoryview:
+        quote = lambda value: value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+        header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{quote(name)}"'
+        if filename is not None:
+            header += f'; filename="{quote(filename)}"\r\nContent-Type: {content_type}'
+        return memoryview(f"{header}\r\n\r\n".encode())
+
+    def __add(self, header:memoryview, payload:memoryview|typing.BinaryIO) -> None:
+        self.__parts.extend([(header, 0), (payload, 0), (memoryview(b"\r\n"), 0)])
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset:int, whence:int=os.SEEK_SET) -> int:
+        '''Only rewinding is supported, every attempt of a request starts from the top.'''
+        if offset != 0 or whence != os.SEEK_SET:
+            raise io.UnsupportedOperation("MultipartStream can only be rewound")
+        self.__index = 0
+        self.__position = 0
+        for ix, (part, _) in enumerate(self.__parts):
+            if not isinstance(part, memoryview):
+                part.seek(0)
+            self.__parts[ix] = (part, 0)
+        return 0
+
+    def readinto(self, buffer:typing.Any) -> int:
+        buffer = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(buffer) and self.__index < len(self.__parts):
+            part, offset = self.__parts[self.__index]
+            if isinstance(part, memoryview):
+                chunk = part[offset:offset+len(buffer)-filled]
+            else:
+                chunk = part.read(len(buffer)-filled)
+            if not chunk:
+                self.__index += 1
+                continue
+            buffer[filled:filled+len(chunk)] = chunk
+            filled += len(chunk)
+            self.__parts[self.__index] = (part, offset+len(chunk))
+        self.__position += filled
+        return filled
+
+class TokenBucket:
+    '''Thread-safe token bucket, refills at rate tokens per second up to capacity.'''
+    def __init__(self, rate:float, capacity:int) -> None:
+        self.__rate = rate
+        self.__capacity = max(capacity, 1)
+        self.__tokens = float(self.__capacity)
+        self.__updated = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__lock = threading.Lock()
+
+    def reserve(self, cost:int=1) -> float:
+        '''Takes cost tokens if available and returns 0, otherwise returns the seconds to wait before asking again.
+        Never blocks, so an event loop can do the waiting with asyncio.sleep.'''
+        cost = min(cost, self.__capacity)
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+            if now >= self.__blocked_until and self.__tokens >= cost:
+                self.__tokens -= cost
+                return 0.0
+            return max(self.__blocked_until - now, (cost - self.__tokens) / self.__rate)
+
+    def acquire(self, cost:int=1) -> float:
+        '''Blocks until cost tokens are available and takes them, returns the seconds waited.'''
+        waited = 0.0
+        while delay := self.reserve(cost):
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+    def defer(self, seconds:float) -> None:
+        '''Holds every acquire back for the given seconds, used when the server asks to retry later.'''
+        with self.__lock:
+            self.__blocked_until = max(self.__blocked_until, time.monotonic() + seconds)
+            self.__tokens = 0.0
+
+class HostMap(dict):
+    '''Dict keyed by hostname whose lookups also match parent domains, i.imgur.com finds imgur.com.
+    A lookup costs one probe per label of the URL's host, however many hosts are registered.'''
+    def lookup(self, url:str, default:typing.Any=None) -> typing.Any:
+        labels = (urllib.parse.urlparse(url).hostname or "").split(".")
+        for ix in range(len(labels)):
+            value = self.get(".".join(labels[ix:]))
+            if value is not None:
+                return value
+        return default
+
+class RetryPolicy:
+    '''How many attempts a host gets and how long to back off between them.
+    Responses and errors are classified as permanent, transient or rate limited,
+    only the last two are retried.'''
+    PERMANENT_STATUSES = {400, 401, 403, 404, 405, 410, 413, 414, 415, 451}
+    PERMANENT_ERRORS = (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema, requests.exceptions.URLRequired)
+
+    def __init__(self, attempts:int, base_delay:float, max_delay:float=RETRY_MAX_DELAY) -> None:
+        self.attempts = max(int(attempts), 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def classify_status(self, status_code:int) -> str:
+        if status_code == 429:
+            return "rate_limited"
+        elif status_code in self.PERMANENT_STATUSES:
+            return "permanent"
+        else:
+            return "transient"
+
+    def classify_error(self, error:Exception) -> str:
+        if isinstance(error, self.PERMANENT_ERRORS):
+            return "permanent"
+        else:
+            return "transient"
+
+    def backoff(self, attempt:int) -> float:
+        '''Capped exponential delay with full jitter for the given zero-based attempt.'''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    @staticmethod
+    def retry_after(payload:typing.Any, header:str|None) -> float|None:
+        '''Seconds to wait from Telegram's parameters.retry_after in the parsed body or the Retry-After header.'''
+        try:
+            return float(payload["parameters"]["retry_after"])
+        except Exception:
+            pass
+        try:
+            return float(header or "")
+        except ValueError:
+            return None
+
 class RequestsHelper:
     def __init__(self, logger:LoggingHelper) -> None:
         '''Requires an existing LoggingHelper object.'''
         self.__logger = logger
+        self.__sessions = {}
+        self.__sessions_lock = threading.Lock()
+        self.__buckets = {}
+        self.__policies = {"GET":HostMap(), "POST":HostMap()}
+        self.__host_limits = HostMap()
+        self.__default_policies = {
+            "GET":RetryPolicy(GET_ATTEMPTS, SLEEP_ON_FAILED_GET),
+            "POST":RetryPolicy(POST_ATTEMPTS, SLEEP_ON_FAILED_POST)
+        }
+        self.__retry_stats = {}
+        for host, policy in RETRY_POLICIES.items():
+            self.set_retry_policy(host, RetryPolicy(*policy))
+
+    def set_retry_policy(self, host:str, policy:RetryPolicy, method:str|None=None) -> None:
+        '''Overrides the retry policy for a host and its subdomains, for one method or both.'''
+        for current_method in ([method] if method else ["GET", "POST"]):
+            self.__policies[current_method][host.lower()] = policy
+
+    def retry_policy(self, resource_url:str, method:str) -> RetryPolicy:
+        '''The retry policy for a request, the host's own or the method's default.'''
+        # HEAD probes are retried like the GET they stand in for.
+        method = "GET" if method == "HEAD" else method
+        return self.__policies[method].lookup(resource_url, self.__default_policies[method])
+
+    def set_host_limit(self, host:str, rate:float, capacity:int) -> None:
+        '''Rate limits every request to a host and its subdomains.'''
+        key = f"host:{host.lower()}"
+        self.limit(key, rate, capacity)
+        self.__host_limits[host.lower()] = key
+
+    def record(self, resource_url:str, outcome:str) -> None:
+        '''Counts one attempt against the URL's host in retry_stats.'''
+        host = urllib.parse.urlparse(resource_url).netloc.lower()
+        with self.__sessions_lock:
+            host_stats = self.__retry_stats.setdefault(host, {"ok":0, "permanent":0, "transient":0, "rate_limited":0})
+            host_stats[outcome] += 1
+
+    def retry_stats(self) -> dict[str, dict[str, int]]:
+        '''Per-host counts of request attempts by outcome class.'''
+        with self.__sessions_lock:
+            return {host:dict(host_stats) for host, host_stats in self.__retry_stats.items()}
+
+    def limit(self, key:str, rate:float, capacity:int) -> None:
+        '''Registers a rate limit that post and throttle can refer to by key.'''
+        with self.__sessions_lock:
+            if key not in self.__buckets:
+                self.__buckets[key] = TokenBucket(rate, capacity)
+
+    def throttle(self, limits:list[str], cost:int=1) -> None:
+        '''Waits until every listed rate limit allows cost more requests.'''
+        for key in limits:
+            waited = self.__buckets[key].acquire(cost)
+            if waited:
+                self.__logger.debug("Requests", f"Waited {waited:.2f} seconds for rate limit: {key}")
+
+    def defer(self, limits:list[str], seconds:float) -> None:
+        for key in limits:
+            self.__buckets[key].defer(seconds)
+
+    def reserve(self, key:str, cost:int=1) -> float:
+        '''Non-blocking throttle for one rate limit, returns the seconds to wait when it is exhausted.'''
+        return self.__buckets[key].reserve(cost)
+
+    def request_limits(self, resource_url:str, limits:list[str]|None=None) -> list[str]:
+        '''The listed rate limits plus the one set for the URL's host, if any.'''
+        host_limit = self.__host_limits.lookup(resource_url)
+        if host_limit is not None:
+            return [*(limits or []), host_limit]
+        return limits or []
+
+    def __session(self, resource_url:str) -> requests.Session:
+        '''Returns the pooled session for the URL's host, creating it on first use.'''
+        host = urllib.parse.urlparse(resource_url).netloc.lower()
+        with self.__sessions_lock:
+            session = self.__sessions.get(host)
+            if session is None:
+                self.__logger.debug("Requests", f"Opening connection pool for host: {host}")
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                if not HTTP_KEEP_ALIVE:
+                    session.headers["Connection"] = "close"
+                self.__sessions[host] = session
+            return session
+
+    def connection_stats(self) -> dict[str, dict[str, int]]:
+        '''Per-host counts of connections newly opened and requests that reused one.'''
+        stats = {}
+        with self.__sessions_lock:
+            sessions = dict(self.__sessions)
+        for host, session in sessions.items():
+            opened = 0
+            requests_made = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    opened += pool.num_connections
+                    requests_made += pool.num_requests
+            stats[host] = {"opened":opened, "reused":max(requests_made - opened, 0)}
+        return stats
     
-    def get(self, resource_url:str) -> requests.Response|None:
-        '''GET Request, returns Response if no errors, None otherwise.'''
-        get_headers = REQUEST_HEADERS
-        blacklist = ["https://i.imgur.com/removed.png"]
-        resource_obtained = False
-        attempts_till_now = 0
+    def get(self, resource_url:str, stream:bool=False) -> requests.Response|None:
+        '''GET Request, returns Response if no errors, None otherwise.
+        With stream set, the body is left unread for the caller to consume.'''
         self.__logger.debug("Requests", f"Sending GET request to URL: {resource_url}")
-        while (not resource_obtained) and (attempts_till_now < GET_ATTEMPTS):
-            try:
-                self.__logger.debug("Requests", f"Current attempt: {attempts_till_now+1}/{GET_ATTEMPTS}")
-                response = requests.get(resource_url, headers=get_headers)
-            except Exception as error:
-                self.__logger.error("Requests", error)
-                self.__logger.debug("Requests", f"Exception was thrown, retrying after {3*SLEEP_ON_FAILED_GET} seconds.")
-                time.sleep(3*SLEEP_ON_FAILED_GET)
-            else:
-                for blacklisted_url in blacklist:
-                    if response.url == blacklisted_url:
-                        self.__logger.error("Requests", "URL blacklisted, failure obtaining resource.")
-                        return None
-                if response.status_code == 200:
-                    resource_obtained = True
-                    break
-                else:
-                    self.__logger.debug("Requests", f"Attempt unsuccessful, retrying in {SLEEP_ON_FAILED_GET} seconds.")
-                    attempts_till_now += 1
-                    time.sleep(SLEEP_ON_FAILED_GET)
-        if resource_obtained:
+        response = self.__request("GET", resource_url, stream=stream)
+        if response is not None:
             self.__logger.info("Requests", "Resource obtained successfully.")
-            return response
         else:
-            self.__logger.debug("Requests", f"Request returned {response.status_code}({response.reason}).")
             self.__logger.error("Requests", "Failure obtaining resource.")
-            return None
+        return response
 
-    def post(self, api_url:str, files=None, data=None) -> requests.Response|None:
-        '''POST Request, returns Response if no errors, None otherwise.'''
-        post_headers = REQUEST_HEADERS
-        resource_sent = False
-        attempts_till_now = 0
-        self.__logger.debug("Requests", f"Sending POST request to Telegram API")
-        while (not resource_sent) and (attempts_till_now < POST_ATTEMPTS):
+    def __request(self, method:str, url:str, consume:typing.Callable|None=None, files=None, data=None, limits:list[str]|None=None, cost:int=1, errors:list[str]|None=None, **kwargs) -> typing.Any:
+        '''Runs the attempts of a request under the host's retry policy.
+        Permanent failures return at once, transient ones back off and 429s wait as told.
+        Every attempt runs under the connect and read timeouts, a stalled socket counts as transient.
+        With consume, a 200 response is read into the result within the attempt, so a body that
+        fails to read is retried too. Otherwise the response itself is returned.
+        A request that gives up appends "permanent" or "transient" to errors, if given.'''
+        policy = self.retry_policy(url, method)
+        limits = self.request_limits(url, limits)
+        headers = REQUEST_HEADERS
+        if files:
+            data = MultipartStream(files, data)
+            headers = {**REQUEST_HEADERS, "Content-Type":data.content_type}
+        for attempt in range(policy.attempts):
+            self.__logger.debug("Requests", f"Current attempt: {attempt+1}/{policy.attempts}")
+            retry_after = None
+            response = None
             try:
-                self.__logger.debug("Requests", f"Current attempt: {attempts_till_now+1}/{POST_ATTEMPTS}")
-                response = requests.post(api_url, files=files, data=data, headers=post_headers)
+                self.throttle(limits, cost)
+                self.__rewind(data)
+                response = self.__session(url).request(method, url, data=data, headers=headers, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), **kwargs)
+                if response.url in REMOVED_MEDIA_URLS:
+                    self.__logger.error("Requests", "Redirected to removed media placeholder.")
+                    outcome = "permanent"
+                elif response.status_code == 200:
+                    result = consume(response) if consume is not None else response
+                    self.record(url, "ok")
+                    return result
+                else:
+                    self.__logger.debug("Requests", f"Request returned {response.status_code}({response.reason}).")
+                    outcome = policy.classify_status(response.status_code)
+                    if outcome == "rate_limited":
+                        retry_after = self.__retry_after(response)
+                response.close()
             except Exception as error:
                 self.__logger.error("Requests", error)
-                self.__logger.debug("Requests", f"Exception was thrown, retrying after {3*SLEEP_ON_FAILED_POST} seconds.")
-                time.sleep(3*SLEEP_ON_FAILED_POST)
-            else:
-                if response.status_code == 200:
-                    resource_sent = True
-                    break
+                outcome = policy.classify_error(error)
+                if response is not None:
+                    response.close()
+            self.record(url, outcome)
+            if outcome == "permanent":
+                self.__logger.debug("Requests", "Permanent failure, not retrying.")
+                break
+            if attempt+1 >= policy.attempts:
+                break
+            if retry_after is not None:
+                self.__logger.info("Requests", f"Rate limited, retrying in {retry_after} seconds.")
+                if limits:
+                    self.defer(limits, retry_after)
                 else:
-                    self.__logger.debug("Requests", f"Attempt unsuccessful, retrying in {SLEEP_ON_FAILED_POST} seconds.")
-                    attempts_till_now += 1
-                    time.sleep(SLEEP_ON_FAILED_POST)
-        if resource_sent:
+                    time.sleep(retry_after)
+            else:
+                delay = policy.backoff(attempt)
+                self.__logger.debug("Requests", f"Attempt unsuccessful, retrying in {delay:.2f} seconds.")
+                time.sleep(delay)
+        if errors is not None:
+            errors.append("permanent" if outcome == "permanent" else "transient")
+        return None
+
+    def probe(self, resource_url:str) -> bool:
+        '''HEAD Request, True if the resource exists, without downloading its body.'''
+        self.__logger.debug("Requests", f"Sending HEAD request to URL: {resource_url}")
+        response = self.__request("HEAD", resource_url, allow_redirects=True)
+        if response is not None:
+            response.close()
+            return True
+        else:
+            return False
+
+    def download(self, resource_url:str, max_bytes:int=DOWNLOAD_SIZE_CAP, errors:list[str]|None=None) -> Download|None:
+        '''Streams resource into a spooled temporary file, hashing on the way.
+        Stops early once max_bytes is exceeded and returns a "too large" Download.
+        A body that breaks off or ends short of its Content-Length is retried like a failed request.
+        On failure its class, "permanent" or "transient", is appended to errors if given.'''
+        def consume(response:requests.Response) -> Download:
+            with response:
+                content_type = response.headers.get("Content-Type", "")
+                declared_size = response.headers.get("Content-Length")
+                if declared_size is not None and declared_size.isdigit() and int(declared_size) > max_bytes:
+                    self.__logger.info("Requests", f"Declared size {declared_size} exceeds cap of {max_bytes} bytes, skipping download.")
+                    return Download(resource_url, response.url, content_type, None, int(declared_size), "", b"", too_large=True)
+                spool = DownloadSpool(resource_url, max_bytes, DownloadSpool.expected_size(response.headers))
+                try:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if not spool.write(chunk):
+                            self.__logger.info("Requests", f"Download exceeded cap of {max_bytes} bytes, aborting.")
+                            return spool.too_large(response.url, content_type)
+                except BaseException:
+                    spool.close()
+                    raise
+            download = spool.result(response.url, content_type)
+            self.__logger.info("Requests", f"Downloaded {spool.size} bytes.")
+            return download
+
+        self.__logger.debug("Requests", f"Sending GET request to URL: {resource_url}")
+        download = self.__request("GET", resource_url, consume, errors=errors, stream=True)
+        if download is None:
+            self.__logger.error("Requests", "Failure obtaining resource.")
+        return download
+
+    def post(self, api_url:str, files=None, data=None, limits:list[str]|None=None, cost:int=1, errors:list[str]|None=None) -> requests.Response|None:
+        '''POST Request, returns Response if no errors, None otherwise.
+        Every attempt waits on the listed rate limits, a 429 defers them by the requested time.
+        On failure its class is appended to errors if given.'''
+        self.__logger.debug("Requests", f"Sending POST request to Telegram API")
+        response = self.__request("POST", api_url, files=files, limits=limits, cost=cost, data=data, errors=errors)
+        if response is not None:
             self.__logger.info("Requests", "Resource sent successfully.")
-            return response
         else:
-            self.__logger.debug("Requests", f"Request returned {response.status_code}({response.reason}).")
             self.__logger.error("Requests", "Failure sending resource.")
-            return None
+        return response
 
-    def check_domain(self, resource_url:str) -> list[str, str]:
-        self.__logger.debug("Requests", "Checking URL domain.")
-        if "i.redd.it" in resource_url:
-            return "REDDIT_IMAGE", resource_url
-        elif "v.redd.it" in resource_url:
-            return "REDDIT_VIDEO", resource_url
-        elif "reddit.com/gallery" in resource_url:
-            return "REDDIT_GALLERY", resource_url
-        elif "imgur.com" in resource_url:
-            return "IMGUR", resource_url.replace(".gifv",".mp4").replace(".gif",".mp4")
-        if "redgifs.com" in resource_url:
-            return "REDGIFS", resource_url
-        elif "gfycat.com" in resource_url:
-            return "GFYCAT", resource_url
-        else:
-            return "OTHERS", resource_url
+    def __retry_after(self, response:requests.Response) -> float|None:
+        try:
+            payload = response.json()
+        except Exception:
+            payload = None
+        return RetryPolicy.retry_after(payload, response.headers.get("Retry-After"))
+
+    def __rewind(self, data:typing.Any) -> None:
+        # A streamed body is consumed by every attempt, start each one from the top.
+        if isinstance(data, MultipartStream):
+            data.seek(0)
 
     def page_text(self, page_url:str) -> str|None:
         '''Returns page contents as text.'''
@@ -156,130 +806,789 @@ class RequestsHelper:
         '''JSON URL -> list/dict object.'''
         self.__logger.debug("Requests", "Loading json from URL.")
         response = self.get(json_url)
-        if response and json_url.endswith(".json"):
+        if response and urllib.parse.urlparse(json_url).path.endswith(".json"):
             return json.load(io.BytesIO(response.content))
         else:
             return None
 
-class File:
-    def __init__(self, resource_url:str, logger:LoggingHelper, requester:RequestsHelper) -> None:
+class MediaCache:
+    '''Content-addressed on-disk cache of downloaded media, indexed by URL in the state database.
+    Blobs are stored once per sha512 and evicted least recently used first once over budget.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, database:Database, directory:str=MEDIA_CACHE_DIR, budget:int=MEDIA_CACHE_SIZE) -> None:
+        '''Requires existing LoggingHelper, RequestsHelper and Database objects.'''
+        self.__logger = logger
+        self.__requester = requester
+        self.__database = database
+        self.__directory = directory
+        self.__budget = budget
+        self.__hosts = HostMap()
+        os.makedirs(self.__directory, exist_ok=True)
+        self.__database.execute("CREATE TABLE IF NOT EXISTS media_blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, content_type TEXT NOT NULL, last_used REAL NOT NULL)")
+        self.__database.execute("CREATE INDEX IF NOT EXISTS media_blobs_lru ON media_blobs (last_used)")
+        self.__database.execute("CREATE TABLE IF NOT EXISTS media_urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL, final_url TEXT NOT NULL)")
+        self.__database.execute("CREATE INDEX IF NOT EXISTS media_urls_hash ON media_urls (hash)")
+
+    def __path(self, hash:str) -> str:
+        return os.path.join(self.__directory, hash[:2], hash)
+
+    def allow(self, host:str) -> None:
+        '''Enables caching for media served from a host and its subdomains.'''
+        self.__hosts[host.lower()] = True
+
+    def download(self, resource_url:str, errors:list[str]|None=None) -> Download|None:
+        '''Drop-in for RequestsHelper.download that serves cached media before the network.
+        Only hosts enabled with allow are cached, anything else goes straight to the network.'''
+        cached = self.lookup(resource_url)
+        if cached is not None:
+            return cached
+        download = self.__requester.download(resource_url, errors=errors)
+        self.store(download)
+        return download
+
+    def lookup(self, resource_url:str) -> Download|None:
+        '''Cached media for the URL, None when it is missing or its host is not cached.'''
+        if not self.__hosts.lookup(resource_url, False):
+            return None
+        rows = self.__database.execute("SELECT media_urls.hash, final_url, size, content_type FROM media_urls JOIN media_blobs ON media_urls.hash = media_blobs.hash WHERE url = ?", (resource_url,))
+        if not rows:
+            return None
+        hash, final_url, size, content_type = rows[0]
+        try:
+            file = open(self.__path(hash), "rb")
+        except OSError:
+            self.__forget(hash)
+            return None
+        self.__database.execute("UPDATE media_blobs SET last_used = ? WHERE hash = ?", (time.time(), hash))
+        head = file.read(MIME_SNIFF_BYTES)
+        file.seek(0)
+        self.__logger.info("Cache", f"Serving {size} bytes from media cache.")
+        return Download(resource_url, final_url, content_type, file, size, hash, head)
+
+    def store(self, download:Download|None) -> None:
+        '''Keeps a complete download from a cached host, anything else is left alone.
+        A body that does not match its declared length is never cached, retries would be served the broken copy.'''
+        if download is None or download.file is None or download.too_large or not self.__hosts.lookup(download.url, False):
+            return
+        if download.expected_size is not None and download.size != download.expected_size:
+            self.__logger.error("Cache", f"Not caching {download.size} bytes of a body declared as {download.expected_size} bytes.")
+            return
+        if download.size > self.__budget:
+            return
+        path = self.__path(download.hash)
+        try:
+            if not os.path.isfile(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Written under a unique name and renamed, readers never see a partial blob.
+                with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as output_file:
+                    download.file.seek(0)
+                    while chunk := download.file.read(DOWNLOAD_CHUNK_SIZE):
+                        output_file.write(chunk)
+                os.replace(output_file.name, path)
+        except OSError as error:
+            self.__logger.error("Cache", error)
+            return
+        finally:
+            download.file.seek(0)
+        with self.__database.transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO media_blobs VALUES (?, ?, ?, ?)", (download.hash, download.size, download.content_type, time.time()))
+            connection.execute("INSERT OR REPLACE INTO media_urls VALUES (?, ?, ?)", (download.url, download.hash, download.final_url))
+        self.__evict()
+
+    def __evict(self) -> None:
+        total = self.__database.execute("SELECT COALESCE(SUM(size), 0) FROM media_blobs")[0][0]
+        if total <= self.__budget:
+            return
+        for hash, size in self.__database.execute("SELECT hash, size FROM media_blobs ORDER BY last_used"):
+            if total <= self.__budget:
+                break
+            self.__forget(hash)
+            total -= size
+        self.__logger.debug("Cache", f"Media cache trimmed to {total} bytes.")
+
+    def __forget(self, hash:str) -> None:
+        with self.__database.transaction() as connection:
+            connection.execute("DELETE FROM media_urls WHERE hash = ?", (hash,))
+            connection.execute("DELETE FROM media_blobs WHERE hash = ?", (hash,))
+        try:
+            os.remove(self.__path(hash))
+        except OSError:
+            pass
+
+class FilePayload(aiohttp.payload.Payload):
+    '''Streams a file object into a request body from the top, leaving it open for the next attempt or send.
+    aiohttp's own file payloads close the file once written.'''
+    def __init__(self, value:typing.BinaryIO, *args, **kwargs) -> None:
+        super().__init__(value, *args, **kwargs)
+        self._size = value.seek(0, os.SEEK_END)
+        value.seek(0)
+
+    async def write(self, writer:typing.Any) -> None:
+        loop = asyncio.get_running_loop()
+        self._value.seek(0)
+        while chunk := await loop.run_in_executor(None, self._value.read, DOWNLOAD_CHUNK_SIZE):
+            await writer.write(chunk)
+
+class AsyncRequestsHelper:
+    '''asyncio counterpart of RequestsHelper on aiohttp, many requests share one event loop instead of a thread each.
+    Retry policies, rate limits and stats are read from the given RequestsHelper, so both engines share them.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, max_in_flight:int=ASYNC_MAX_IN_FLIGHT) -> None:
+        '''Requires existing LoggingHelper and RequestsHelper objects, must be used from a single event loop.'''
+        self.__logger = logger
+        self.__requester = requester
+        self.__max_in_flight = max_in_flight
+        self.__session = None
+        self.__in_flight = None
+
+    def __client(self) -> aiohttp.ClientSession:
+        # Created on first use so the session and semaphore belong to the running loop.
+        if self.__session is None:
+            connector = aiohttp.TCPConnector(limit=self.__max_in_flight, limit_per_host=ASYNC_HOST_CONNECTIONS, force_close=not HTTP_KEEP_ALIVE)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+            self.__session = aiohttp.ClientSession(connector=connector, headers=REQUEST_HEADERS, timeout=timeout)
+            self.__in_flight = asyncio.Semaphore(self.__max_in_flight)
+        return self.__session
+
+    async def close(self) -> None:
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    async def throttle(self, limits:list[str], cost:int=1) -> None:
+        '''Waits until every listed rate limit allows cost more requests, without blocking the loop.'''
+        for key in limits:
+            waited = 0.0
+            while delay := self.__requester.reserve(key, cost):
+                await asyncio.sleep(delay)
+                waited += delay
+            if waited:
+                self.__logger.debug("Requests", f"Waited {waited:.2f} seconds for rate limit: {key}")
+
+    async def __request(self, method:str, url:str, consume:typing.Callable, files=None, data=None, limits:list[str]|None=None, cost:int=1, errors:list[str]|None=None, **kwargs) -> typing.Any:
+        '''Runs the attempts of a request like RequestsHelper does, consume reads a 200 response into the result.
+        At most max_in_flight attempts hold a connection at once, the rest wait their turn.'''
+        policy = self.__requester.retry_policy(url, method)
+        limits = self.__requester.request_limits(url, limits)
+        for attempt in range(policy.attempts):
+            self.__logger.debug("Requests", f"Current attempt: {attempt+1}/{policy.attempts}")
+            retry_after = None
+            try:
+                await self.throttle(limits, cost)
+                session = self.__client()
+                async with self.__in_flight:
+                    async with session.request(method, url, data=self.__form(files, data), **kwargs) as response:
+                        if str(response.url) in REMOVED_MEDIA_URLS:
+                            self.__logger.error("Requests", "Redirected to removed media placeholder.")
+                            outcome = "permanent"
+                        elif response.status == 200:
+                            result = await consume(response)
+                            self.__requester.record(url, "ok")
+                            return result
+                        else:
+                            self.__logger.debug("Requests", f"Request returned {response.status}({response.reason}).")
+                            outcome = policy.classify_status(response.status)
+                            if outcome == "rate_limited":
+                                retry_after = await self.__retry_after(response)
+            except Exception as error:
+                self.__logger.error("Requests", error)
+                outcome = "permanent" if isinstance(error, aiohttp.InvalidURL) else policy.classify_error(error)
+            self.__requester.record(url, outcome)
+            if outcome == "permanent":
+                self.__logger.debug("Requests", "Permanent failure, not retrying.")
+                break
+            if attempt+1 >= policy.attempts:
+                break
+            if retry_after is not None:
+                self.__logger.info("Requests", f"Rate limited, retrying in {retry_after} seconds.")
+                if limits:
+                    self.__requester.defer(limits, retry_after)
+                else:
+                    await asyncio.sleep(retry_after)
+            else:
+                delay = policy.backoff(attempt)
+                self.__logger.debug("Requests", f"Attempt unsuccessful, retrying in {delay:.2f} seconds.")
+                await asyncio.sleep(delay)
+        if errors is not None:
+            errors.append("permanent" if outcome == "permanent" else "transient")
+        return None
+
+    async def __retry_after(self, response:aiohttp.ClientResponse) -> float|None:
+        try:
+            payload = await response.json(content_type=None)
+        except Exception:
+            payload = None
+        return RetryPolicy.retry_after(payload, response.headers.get("Retry-After"))
+
+    def __form(self, files:dict|None, data:dict|None) -> aiohttp.FormData|dict|None:
+        '''Builds the body of one attempt from requests-style files and data.'''
+        if not files:
+            return data
+        form = aiohttp.FormData()
+        for key, value in (data or {}).items():
+            form.add_field(key, str(value))
+        for key, value in files.items():
+            filename, payload, content_type = (*value, None)[:3] if isinstance(value, tuple) else (key, value, None)
+            if payload is None:
+                continue
+            if hasattr(payload, "read"):
+                payload = FilePayload(payload, filename=filename, content_type=content_type)
+            form.add_field(key, payload, filename=filename, content_type=content_type)
+        return form
+
+    async def get(self, resource_url:str) -> bytes|None:
+        '''GET Request, returns the body if no errors, None otherwise.'''
+        self.__logger.debug("Requests", f"Sending GET request to URL: {resource_url}")
+        body = await self.__request("GET", resource_url, lambda response: response.read())
+        if body is not None:
+            self.__logger.info("Requests", "Resource obtained successfully.")
+        else:
+            self.__logger.error("Requests", "Failure obtaining resource.")
+        return body
+
+    async def probe(self, resource_url:str) -> bool:
+        '''HEAD Request, True if the resource exists, without downloading its body.'''
+        self.__logger.debug("Requests", f"Sending HEAD request to URL: {resource_url}")
+        return bool(await self.__request("HEAD", resource_url, self.__exists, allow_redirects=True))
+
+    async def __exists(self, response:aiohttp.ClientResponse) -> bool:
+        return True
+
+    async def download(self, resource_url:str, max_bytes:int=DOWNLOAD_SIZE_CAP, errors:list[str]|None=None) -> Download|None:
+        '''Streams resource into a spooled temporary file like RequestsHelper.download, retrying broken or short bodies.
+        A cancelled download closes its spool before the cancellation propagates.'''
+        async def consume(response:aiohttp.ClientResponse) -> Download:
+            content_type = response.headers.get("Content-Type", "")
+            declared_size = response.headers.get("Content-Length")
+            if declared_size is not None and declared_size.isdigit() and int(declared_size) > max_bytes:
+                self.__logger.info("Requests", f"Declared size {declared_size} exceeds cap of {max_bytes} bytes, skipping download.")
+                return Download(resource_url, str(response.url), content_type, None, int(declared_size), "", b"", too_large=True)
+            spool = DownloadSpool(resource_url, max_bytes, DownloadSpool.expected_size(response.headers))
+            try:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    if not spool.write(chunk):
+                        self.__logger.info("Requests", f"Download exceeded cap of {max_bytes} bytes, aborting.")
+                        return spool.too_large(str(response.url), content_type)
+            except BaseException:
+                # Cancelled or broken off, the spool goes either way and a broken body is retried.
+                spool.close()
+                raise
+            download = spool.result(str(response.url), content_type)
+            self.__logger.info("Requests", f"Downloaded {spool.size} bytes.")
+            return download
+
+        self.__logger.debug("Requests", f"Sending GET request to URL: {resource_url}")
+        return await self.__request("GET", resource_url, consume, errors=errors)
+
+    async def download_many(self, url_list:list[str], cache:MediaCache|None=None, errors:list[str]|None=None) -> list[Download|None]:
+        '''Downloads every URL concurrently through the media cache if given, results keep the order of url_list.
+        An item that raises comes back as None, cancelling the call cancels every download still running.
+        The class of every failed download is appended to errors if given.'''
+        async def fetch(url:str) -> Download|None:
+            cached = cache.lookup(url) if cache is not None else None
+            if cached is not None:
+                return cached
+            download = await self.download(url, errors=errors)
+            if cache is not None:
+                # Blob writes go to a worker thread, the loop keeps serving the other downloads.
+                await asyncio.get_running_loop().run_in_executor(None, cache.store, download)
+            return download
+
+        results = await asyncio.gather(*(fetch(url) for url in url_list), return_exceptions=True)
+        downloads = []
+        for url, result in zip(url_list, results):
+            if isinstance(result, BaseException):
+                self.__logger.error("Requests", result)
+                self.__logger.error("Requests", f"Failure downloading URL: {url}")
+                result = None
+            downloads.append(result)
+        return downloads
+
+    async def post(self, api_url:str, files=None, data=None, limits:list[str]|None=None, cost:int=1, errors:list[str]|None=None) -> bytes|None:
+        '''POST Request, returns the response body if no errors, None otherwise.'''
+        self.__logger.debug("Requests", f"Sending POST request to Telegram API")
+        body = await self.__request("POST", api_url, lambda response: response.read(), files=files, data=data, limits=limits, cost=cost, errors=errors)
+        if body is not None:
+            self.__logger.info("Requests", "Resource sent successfully.")
+        else:
+            self.__logger.error("Requests", "Failure sending resource.")
+        return body
+
+    async def page_text(self, page_url:str) -> str|None:
+        '''Returns page contents as text.'''
+        self.__logger.debug("Requests", "Loading page as text.")
+        return await self.__request("GET", page_url, lambda response: response.text())
+
+    async def load_json(self, json_url:str) -> list|dict|None:
+        '''JSON URL -> list/dict object.'''
+        self.__logger.debug("Requests", "Loading json from URL.")
+        if not urllib.parse.urlparse(json_url).path.endswith(".json"):
+            return None
+        body = await self.get(json_url)
+        if body:
+            return json.loads(body)
+        else:
+            return None
+
+class AsyncEngine:
+    '''One asyncio event loop on a background thread, blocking code hands it coroutines through run.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper) -> None:
         '''Requires existing LoggingHelper and RequestsHelper objects.'''
         self.__logger = logger
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name="async-engine", daemon=True)
+        self.__thread.start()
+        self.requester = AsyncRequestsHelper(self.__logger, requester)
+        self.__logger.info("Async", f"Event loop started, up to {ASYNC_MAX_IN_FLIGHT} requests in flight.")
+
+    def run(self, coroutine:typing.Coroutine) -> typing.Any:
+        '''Runs a coroutine on the engine's loop and blocks until its result.'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
+
+    def close(self) -> None:
+        self.run(self.requester.close())
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+class DashRendition:
+    '''One Representation of a DASH manifest, size is estimated from bandwidth and duration.'''
+    def __init__(self, url:str, kind:str, bandwidth:int, height:int, duration:float) -> None:
+        self.url = url
+        self.kind = kind
+        self.bandwidth = bandwidth
+        self.height = height
+        self.estimated_size = int(bandwidth / 8 * duration)
+
+class RedditVideoResolver:
+    '''Chooses which v.redd.it rendition to download from the post's DASH manifest.'''
+    DURATION_RE = re.compile(r"PT(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?(?:(?P<seconds>[\d.]+)S)?")
+
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, engine:AsyncEngine|None=None) -> None:
+        '''Requires existing LoggingHelper and RequestsHelper objects, requests go through the AsyncEngine if given.'''
+        self.__logger = logger
+        self.__requester = requester
+        self.__engine = engine
+
+    def __page_text(self, page_url:str) -> str|None:
+        if self.__engine is not None:
+            return self.__engine.run(self.__engine.requester.page_text(page_url))
+        return self.__requester.page_text(page_url)
+
+    def __probe(self, resource_url:str) -> bool:
+        if self.__engine is not None:
+            return self.__engine.run(self.__engine.requester.probe(resource_url))
+        return self.__requester.probe(resource_url)
+
+    def resolve(self, manifest_url:str, fallback_url:str, budget:int=FIFTY_MB) -> tuple[str, str|None]:
+        '''Returns the video URL to download and the audio URL, None if the video has no audio.
+        Picks the highest rendition whose estimated size fits the budget and falls back to
+        fallback_url with a HEAD probe for audio when the manifest cannot be used.'''
+        manifest_text = self.__page_text(manifest_url)
+        renditions = self.parse(manifest_text, manifest_url) if manifest_text else []
+        videos = sorted([rendition for rendition in renditions if rendition.kind == "video"], key=lambda rendition: rendition.bandwidth)
+        audios = sorted([rendition for rendition in renditions if rendition.kind == "audio"], key=lambda rendition: rendition.bandwidth)
+        if not videos:
+            self.__logger.info("Reddit", "DASH manifest unavailable, using fallback rendition.")
+            audio_url = fallback_url.split("DASH_")[0] + "DASH_audio.mp4"
+            return fallback_url, audio_url if self.__probe(audio_url) else None
+        audio = audios[-1] if audios else None
+        video_budget = budget * DASH_SIZE_MARGIN - (audio.estimated_size if audio else 0)
+        fitting = [rendition for rendition in videos if rendition.estimated_size <= video_budget]
+        video = fitting[-1] if fitting else videos[0]
+        self.__logger.info("Reddit", f"Chose {video.height}p rendition, estimated {video.estimated_size} bytes of {len(videos)} renditions.")
+        return video.url, audio.url if audio else None
+
+    def parse(self, manifest_text:str, manifest_url:str) -> list[DashRendition]:
+        '''Lists the renditions of a DASH manifest with absolute URLs.'''
+        try:
+            root = xml.etree.ElementTree.fromstring(manifest_text)
+        except xml.etree.ElementTree.ParseError as error:
+            self.__logger.error("Reddit", error)
+            return []
+        duration = self.__parse_duration(root.get("mediaPresentationDuration", ""))
+        renditions = []
+        for adaptation_set in root.iterfind(".//{*}AdaptationSet"):
+            for representation in adaptation_set.iterfind("{*}Representation"):
+                base_url = representation.findtext("{*}BaseURL")
+                # Older manifests only set mimeType, newer ones also set contentType on the set.
+                content_type = adaptation_set.get("contentType") or (representation.get("mimeType") or adaptation_set.get("mimeType", "")).split("/")[0]
+                if not base_url or content_type not in ["video", "audio"]:
+                    continue
+                renditions.append(DashRendition(
+                    urllib.parse.urljoin(manifest_url, base_url.strip()),
+                    content_type,
+                    int(representation.get("bandwidth", 0)),
+                    int(representation.get("height", 0)),
+                    duration
+                ))
+        return renditions
+
+    def __parse_duration(self, duration:str) -> float:
+        match = self.DURATION_RE.fullmatch(duration)
+        if match is None:
+            return 0.0
+        return 3600*float(match["hours"] or 0) + 60*float(match["minutes"] or 0) + float(match["seconds"] or 0)
+
+class ImageNormalizer:
+    '''Re-encodes photos Telegram would only take as documents into photo-compliant images.
+    Runs on its own bounded pool so decoding never takes more than IMAGE_WORKERS cores.'''
+    FORMATS = {"JPEG":("image/jpeg", ".jpg"), "WEBP":("image/webp", ".webp")}
+
+    def __init__(self, logger:LoggingHelper, format:str=IMAGE_NORMALIZE_FORMAT) -> None:
+        '''Requires an existing LoggingHelper object.'''
+        self.__logger = logger
+        self.__format = format if format in self.FORMATS else "JPEG"
+        self.__pool = concurrent.futures.ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+    @property
+    def mime_type(self) -> str:
+        return self.FORMATS[self.__format][0]
+
+    @property
+    def extension(self) -> str:
+        return self.FORMATS[self.__format][1]
+
+    def normalize(self, file:typing.BinaryIO) -> tuple[tempfile.SpooledTemporaryFile, int, tuple[int, int]]|None:
+        '''Returns the re-encoded file, its size and dimensions, None if the image cannot be normalized.'''
+        return self.__pool.submit(self.__normalize, file).result()
+
+    def __normalize(self, file:typing.BinaryIO) -> tuple[tempfile.SpooledTemporaryFile, int, tuple[int, int]]|None:
+        try:
+            with PIL.Image.open(file) as image:
+                if getattr(image, "is_animated", False):
+                    return None
+                # JPEG decodes straight at a reduced DCT scale, the rest is shrunk with reduce() before resampling.
+                image.draft("RGB", (PHOTO_MAX_SIDE, PHOTO_MAX_SIDE))
+                transparent = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+                image = image.convert("RGBA" if transparent else "RGB")
+                image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE), reducing_gap=2.0)
+                if transparent and self.__format == "JPEG":
+                    # JPEG has no alpha, transparent areas go on white rather than the black a plain convert leaves.
+                    background = PIL.Image.new("RGB", image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                output_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+                image.save(output_file, self.__format, quality=IMAGE_QUALITY)
+        except Exception as error:
+            self.__logger.error("File", error)
+            return None
+        size = output_file.tell()
+        output_file.seek(0)
+        self.__logger.info("File", f"Normalized image to {image.width}x{image.height}, {size} bytes.")
+        return output_file, size, (image.width, image.height)
+
+class File:
+    def __init__(self, resource_url:str, logger:LoggingHelper, requester:RequestsHelper, cache:MediaCache|None=None, normalizer:ImageNormalizer|None=None, download:Download|None=None, errors:list[str]|None=None) -> None:
+        '''Requires existing LoggingHelper and RequestsHelper objects, reads through the MediaCache if given.
+        With an ImageNormalizer, photos over Telegram's photo limits are re-encoded to fit them.
+        A Download fetched elsewhere, by the async engine for one, is used instead of fetching again.
+        A failed download appends its class to errors if given.'''
+        self.__logger = logger
         self.__requester = requester
         self.__resource_url = resource_url
-        self.__response = self.__requester.get(self.__resource_url)
+        # Held while a request streams the payload, uploads to several chats take turns reading it.
+        self.upload_lock = threading.Lock()
+        if download is not None:
+            self.__download = download
+        elif cache is not None:
+            self.__download = cache.download(self.__resource_url, errors)
+        else:
+            self.__download = self.__requester.download(self.__resource_url, errors=errors)
+
+        self.__hash = ""
+        self.__mime_type = ""
+        self.__size = 0
+        self.__dimensions = None
+        self.__group = "document"
+        self.__file = None
+        self.__extension = None
+        if self.exists:
+            self.__file = self.__download.file
+            self.__inspect()
+            if normalizer is not None and self.__group == "document" and self.__mime_type in PHOTO_MIMES:
+                self.__normalize(normalizer)
+
+    def __inspect(self) -> None:
+        '''Derives hash, MIME type, dimensions and group once, right after download.'''
+        self.__size = self.__download.size
+        if self.__download.too_large:
+            # Content was never fully read, the URL stands in for it when deduplicating.
+            self.__hash = hashlib.sha512(self.__resource_url.encode()).hexdigest()
+        else:
+            self.__hash = self.__download.hash
+        if self.__download.head:
+            self.__mime_type = magic.from_buffer(self.__download.head, mime=True)
+        else:
+            self.__mime_type = self.__download.content_type.split(";")[0].strip()
+        if self.__mime_type in PHOTO_MIMES and self.__file is not None:
+            self.__dimensions = self.__read_dimensions(self.__payload)
+        self.__group = self.__classify()
+
+    def __normalize(self, normalizer:ImageNormalizer) -> None:
+        '''Swaps the payload for a photo-compliant copy, the hash stays the original's for dedup.'''
+        if self.__dimensions is None or self.__file is None:
+            return
+        width, height = self.__dimensions
+        if max(width / height, height / width) > 20:
+            return
+        normalized = normalizer.normalize(self.__payload)
+        if normalized is None:
+            return
+        file, size, dimensions = normalized
+        if size > TEN_MB:
+            file.close()
+            return
+        self.__file = file
+        self.__size = size
+        self.__dimensions = dimensions
+        self.__mime_type = normalizer.mime_type
+        self.__extension = normalizer.extension
+        self.__group = self.__classify()
+
+    def __read_dimensions(self, file:typing.BinaryIO) -> tuple[int, int]|None:
+        # PIL only parses the header here, pixel data is never decoded.
+        try:
+            with PIL.Image.open(file) as image:
+                return image.width, image.height
+        except Exception as error:
+            self.__logger.error("File", error)
+            return None
+
+    def __classify(self) -> str:
+        if self.__mime_type in PHOTO_MIMES and self.__is_sendable_photo:
+            return "photo"
+        elif self.__mime_type in ANIM_MIMES:
+            return "animation"
+        elif self.__mime_type in VIDEO_MIMES:
+            return "video"
+        elif self.__mime_type in AUDIO_MIMES:
+            return "audio"
+        else:
+            return "document"
 
     @property
     def exists(self) -> bool:
-        if self.__response is not None:
+        if self.__download is not None:
             return True
         else:
             return False
     
+    @property
+    def url(self) -> str:
+        return self.__resource_url
+
     @property
     def name(self) -> str:
         if self.exists:
-            return os.path.basename(urllib.parse.unquote(urllib.parse.urlparse(self.__resource_url).path))
+            name = os.path.basename(urllib.parse.unquote(urllib.parse.urlparse(self.__resource_url).path))
+            if self.__extension is not None:
+                name = os.path.splitext(name)[0] + self.__extension
+            return name
         else:
             return ""
 
     @property
     def bytes(self) -> bytes:
-        if self.exists:
-            return self.__response.content
+        if self.__has_payload:
+            return self.__payload.read()
         else:
             return None
 
     @property
-    def __file(self) -> io.BytesIO:
-        if self.exists:
-            return io.BytesIO(self.bytes)
-        else:
-            return None
-    
+    def __has_payload(self) -> bool:
+        # A "too large" download was never read in full, only its metadata is known.
+        return self.exists and self.__file is not None and not self.__download.too_large
+
+    @property
+    def __payload(self) -> typing.BinaryIO:
+        self.__file.seek(0)
+        return self.__file
+
     @property
     def hash(self) -> str:
-        if self.exists:
-            return hashlib.sha512(self.__file.read()).hexdigest()
-        else:
-            return ""
+        return self.__hash
 
     @property
-    def __mime_type(self) -> str:
-        if self.exists:
-            return magic.from_buffer(self.__file.read(), mime=True)
-        else:
-            return ""
+    def size(self) -> int:
+        return self.__size
 
     @property
-    def __size(self) -> int:
-        if self.exists:
-            return len(self.bytes)
+    def stream(self) -> typing.BinaryIO|None:
+        '''The payload handle for uploads that read it in chunks, left where it is.
+        Building a request must not move it while another chat streams it, readers rewind it under upload_lock.'''
+        if self.__has_payload:
+            return self.__file
         else:
-            return 0
+            return None
+
+    @property
+    def mime_type(self) -> str:
+        return self.__mime_type
 
     @property
     def file_headers(self) -> (dict|None):
         if self.exists:
-            if self.__size > FIFTY_MB:
+            if self.__size > FIFTY_MB or not self.__has_payload:
                 return None
             else:
-                return {self.group:(self.name, self.bytes, self.__mime_type)}
+                return {self.group:(self.name, self.stream, self.__mime_type)}
         else:
             return None
 
     @property
     def group(self) -> str:
-        photo_mimes = ["image/jpeg", "image/png", "image/webp"]
-        anim_mimes = ["image/gif"]
-        video_mimes = ["video/mp4", "video/x-m4v"]
-        audio_mimes = ["audio/mpeg"]
-
-        if self.__mime_type in photo_mimes and self.__is_sendable_photo:
-            return "photo"
-        elif self.__mime_type in anim_mimes:
-            return "animation"
-        elif self.__mime_type in video_mimes:
-            return "video"
-        elif self.__mime_type in audio_mimes:
-            return "audio"
-        else:
-            return "document"
+        return self.__group
 
     @property
     def __is_sendable_photo(self) -> bool:
-        try:
-            image = PIL.Image.open(self.__file)
-        except Exception as error:
-            self.__logger.error("File", error)
+        if self.__dimensions is None:
+            return False
+        width, height = self.__dimensions
+        _WH_ratio = width / height
+        _HW_ratio = height / width
+        _dim_sum = height + width
+        if _WH_ratio > 20 or _HW_ratio > 20 or _dim_sum > 10000 or self.__size > TEN_MB or width > PHOTO_MAX_SIDE or height > PHOTO_MAX_SIDE:
+            return False
         else:
-            width = image.width
-            height = image.height
-            _WH_ratio = width / height
-            _HW_ratio = height / width
-            _dim_sum = height + width
-            if _WH_ratio > 20 or _HW_ratio > 20 or _dim_sum > 10000 or self.__size > TEN_MB or width > 1280 or height > 1280:
-                return False
-            else:
-                return True
+            return True
+
+class TimeoutSession(requests.Session):
+    '''Session that applies the connect and read timeouts to requests made without one,
+    for clients like discord.py's webhook adapter that never pass a timeout.'''
+    def request(self, method:str, url:str, *args, **kwargs) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        return super().request(method, url, *args, **kwargs)
 
 class DiscordHelper:
-    def __init__(self, logger:LoggingHelper) -> None:
-        '''Requires an existing LoggingHelper object.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper) -> None:
+        '''Requires existing LoggingHelper and RequestsHelper objects.
+        Messages still queued when the interpreter exits are flushed on the way out.'''
         self.__logger = logger
+        self.__requester = requester
+        # A stalled webhook times out instead of hanging the only flusher while the queue grows.
+        self.__session = TimeoutSession()
+        self.__webhooks = {}
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__flusher = None
+        atexit.register(self.flush)
 
     def __get_webhook(self, webhook_url:str) -> discord.Webhook:
-        return discord.Webhook.from_url(webhook_url, adapter=discord.RequestsWebhookAdapter())
+        '''Webhook objects are built once per URL and share one pooled HTTP session.'''
+        with self.__lock:
+            webhook = self.__webhooks.get(webhook_url)
+            if webhook is None:
+                webhook = discord.Webhook.from_url(webhook_url, adapter=discord.RequestsWebhookAdapter(session=self.__session))
+                limit = f"discord:{webhook_url}"
+                self.__requester.limit(limit, DISCORD_WEBHOOK_RATE/60, DISCORD_WEBHOOK_BURST)
+                self.__webhooks[webhook_url] = webhook
+            return webhook
 
     def send(self, webhook_url:str, message:str) -> None:
         '''Sends message on webhook.'''
-        self.__get_webhook(webhook_url=webhook_url).send(message)
+        webhook = self.__get_webhook(webhook_url=webhook_url)
+        self.__requester.throttle([f"discord:{webhook_url}"])
+        webhook.send(message)
         self.__logger.info("Discord", "Message posted.")
 
+    def queue(self, webhook_url:str, message:str) -> None:
+        '''Queues message for the webhook, queued messages go out together on the next flush.'''
+        with self.__lock:
+            self.__pending.setdefault(webhook_url, []).append(message)
+            if self.__flusher is None:
+                self.__flusher = threading.Thread(target=self.__flush_periodically, name="discord", daemon=True)
+                self.__flusher.start()
+
+    def __flush_periodically(self) -> None:
+        while True:
+            time.sleep(DISCORD_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        '''Sends every queued message, joined into as few messages per webhook as the content limit allows.
+        Failures are logged and dropped so a broken webhook never holds anything up.'''
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+        for webhook_url, messages in pending.items():
+            for batch in self.__batch(messages):
+                try:
+                    self.send(webhook_url, batch)
+                except Exception as error:
+                    self.__logger.error("Discord", error)
+                    self.__logger.error("Discord", f"Failure posting {len(batch.splitlines())} queued messages.")
+
+    def __batch(self, messages:list[str]) -> list[str]:
+        batches = []
+        current = ""
+        for message in messages:
+            message = message[:DISCORD_CONTENT_LIMIT]
+            if current and len(current) + 1 + len(message) > DISCORD_CONTENT_LIMIT:
+                batches.append(current)
+                current = ""
+            current = f"{current}\n{message}" if current else message
+        if current:
+            batches.append(current)
+        return batches
+
+class Post:
+    '''Details of a Reddit post along with its parsed post data, shared by every solver.'''
+    def __init__(self, post_id:str, title:str, author:str, subreddit:str, primary_link:str, data:dict) -> None:
+        self.id = post_id
+        self.title = title
+        self.author = author
+        self.subreddit = subreddit
+        self.primary_link = primary_link
+        self.data = data
+
+class Delivery:
+    '''Downloaded and captioned media of a post, waiting to be sent by TelegramHelper.deliver.
+    Kind decides the outcome: "single" reports its only send, "group" needs every send
+    to succeed and "metadata" needs at least one. Skipped counts items delivered by an earlier attempt.
+    Missing counts gallery items that could not be downloaded, they fail the post so its retry fetches them again.
+    Aliases are further URLs, like a scraped page, that lead to the media of a single send.
+    Errors collects the class of every download and send that gave up, error sums them up for the retry decision.
+    Subreddit, author and group are what the Router picks its destinations by.'''
+    def __init__(self, post:Post, kind:str="single") -> None:
+        self.post_id = post.id
+        self.subreddit = post.subreddit
+        self.author = post.author
+        self.kind = kind
+        self.sends = []
+        self.skipped = 0
+        self.missing = 0
+        self.aliases = []
+        self.errors = []
+        self.duplicate_of = None
+
+    def add(self, file_list:list, caption_list:list[str], item_list:list[str]|None=None) -> None:
+        '''Queues one send, item_list names the items for checkpointing and defaults to the file URLs.'''
+        self.sends.append((file_list, caption_list, item_list or [file.url for file in file_list]))
+
+    @property
+    def error(self) -> str|None:
+        '''"permanent" when every failed request failed permanently, so a retry cannot do better, "transient" otherwise.
+        None when nothing failed.'''
+        if not self.errors:
+            return None
+        return "permanent" if all(error == "permanent" for error in self.errors) else "transient"
+
+    @property
+    def group(self) -> str|None:
+        '''Group the post is routed by, None while the media of a single post is not known.'''
+        if self.kind != "single":
+            return self.kind
+        if not self.sends or self.sends[0][0][0] is None:
+            return None
+        file = self.sends[0][0][0]
+        if file.file_headers:
+            return file.group
+        return "message" if file.exists else None
+
 class RedditHelper:
-    def __init__(self, logger:LoggingHelper, requester:RequestsHelper) -> None:
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, engine:AsyncEngine|None=None) -> None:
+        '''Requires existing LoggingHelper and RequestsHelper objects, post JSON is fetched through the AsyncEngine if given.'''
         self.__logger = logger
         self.__requester = requester
+        self.__engine = engine
         self.__reddit_client = praw.Reddit(
             user_agent=REDDIT_USER_AGENT,
             client_id=REDDIT_CLIENT_ID,
@@ -287,14 +1596,15 @@ class RedditHelper:
             username=REDDIT_USERNAME,
             password=REDDIT_PASSWORD
         )
+        self.__post_data_cache = {}
+        self.__post_data_lock = threading.Lock()
 
-    def get_post_details(self, post_id:str) -> tuple[str, str, str, str, str]:
-        '''Returns a tuple of strings containing post details.'''
-        json_data = self.__requester.load_json(f"https://www.reddit.com/comments/{post_id}.json")
-        if not self.__check_solubility(json_data):
+    def get_post_details(self, post_id:str) -> Post|None:
+        '''Returns a Post containing post details, None if the post cannot be solved.'''
+        parent_post_data = self.__load_post_data(post_id)
+        if not self.__check_solubility(parent_post_data):
             self.__logger.info("Reddit", "Post cannot be solved.")
-            return []
-        parent_post_data = dict(json_data[0]["data"]["children"][0]["data"])
+            return None
         post_title = self.__fix_json_text(parent_post_data["title"])
         post_author = f"u/{parent_post_data['author']}"
         post_subreddit = parent_post_data["subreddit_name_prefixed"]
@@ -305,16 +1615,68 @@ class RedditHelper:
             post_primary_link = "media_metadata_not_null"
 
         self.__logger.info("Reddit", "Post details obtained successfully.")
-        return [post_id, post_title, post_author, post_subreddit, post_primary_link]
+        return Post(post_id, post_title, post_author, post_subreddit, post_primary_link, parent_post_data)
 
-    def __check_solubility(self, json_data:dict) -> bool:
-        self.__logger.debug("Reddit", "Checking if post is solvable.")
-        if json_data is None:
-            return False
-        elif "error" in json_data:
-            return False
+    def prefetch_post_details(self, post_ids:list[str]) -> int:
+        '''Warms the post data cache through /api/info, 100 posts per request.
+        Returns the number of posts obtained.'''
+        now = time.time()
+        with self.__post_data_lock:
+            missing = [post_id for post_id in post_ids if post_id not in self.__post_data_cache or self.__post_data_cache[post_id][0] <= now]
+        if not missing:
+            return 0
+        self.__logger.debug("Reddit", f"Prefetching details for {len(missing)} posts.")
+        obtained = 0
+        for start in range(0, len(missing), INFO_BATCH_SIZE):
+            fullnames = [f"t3_{post_id}" for post_id in missing[start:start+INFO_BATCH_SIZE]]
+            try:
+                for submission in self.__reddit_client.info(fullnames=fullnames):
+                    self.__cache_post_data(submission.id, self.__submission_data(submission), PREFETCH_TTL)
+                    obtained += 1
+            except Exception as error:
+                self.__logger.error("Reddit", error)
+                self.__logger.error("Reddit", "Failure prefetching post details, falling back to per-post requests.")
+        self.__logger.info("Reddit", f"Prefetched details for {obtained}/{len(missing)} posts.")
+        return obtained
 
-        parent_post_data = json_data[0]["data"]["children"][0]["data"]
+    def __submission_data(self, submission:praw.models.Submission) -> dict:
+        '''Flattens a praw Submission back into the shape of the comments JSON post data.'''
+        parent_post_data = {key:value for key, value in vars(submission).items() if not key.startswith("_")}
+        parent_post_data["author"] = submission.author.name if submission.author else "[deleted]"
+        parent_post_data["subreddit"] = str(submission.subreddit)
+        return parent_post_data
+
+    def __load_post_data(self, post_id:str) -> dict|None:
+        '''Parent post data from the comments JSON, served from cache while fresh.'''
+        with self.__post_data_lock:
+            cached = self.__post_data_cache.get(post_id)
+        if cached is not None and cached[0] > time.time():
+            self.__logger.debug("Reddit", "Using cached post data.")
+            return cached[1]
+
+        # raw_json=1 matches the unescaped text praw gets from /api/info, so cached data has one shape.
+        json_url = f"https://www.reddit.com/comments/{post_id}.json?raw_json=1"
+        if self.__engine is not None:
+            json_data = self.__engine.run(self.__engine.requester.load_json(json_url))
+        else:
+            json_data = self.__requester.load_json(json_url)
+        if json_data is None or "error" in json_data:
+            return None
+        parent_post_data = dict(json_data[0]["data"]["children"][0]["data"])
+        self.__cache_post_data(post_id, parent_post_data, REDDIT_JSON_TTL)
+        return parent_post_data
+
+    def __cache_post_data(self, post_id:str, parent_post_data:dict, ttl:int) -> None:
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self.__post_data_lock:
+            for expired_id in [key for key, (expires_at, _) in self.__post_data_cache.items() if expires_at <= now]:
+                del self.__post_data_cache[expired_id]
+            self.__post_data_cache[post_id] = (now + ttl, parent_post_data)
+
+    def __check_solubility(self, parent_post_data:dict|None) -> bool:
+        self.__logger.debug("Reddit", "Checking if post is solvable.")
         if parent_post_data:
             if "url_overridden_by_dest" in parent_post_data and parent_post_data["url_overridden_by_dest"]:
                 return True
@@ -326,25 +1688,148 @@ class RedditHelper:
             return False
 
     def __fix_json_text(self, escaped_text:str) -> str:
-        return html.unescape(escaped_text.encode("utf-16", "surrogatepass").decode("utf-16"))
+        return escaped_text.encode("utf-16", "surrogatepass").decode("utf-16")
 
-    def get_saved_posts(self, excluded=list[str]):
-        '''Gets a list of currently saved posts excluding the passed list.'''
+    def get_saved_posts(self, excluded:typing.Container[str]|None=None, cursor:str|None=None) -> tuple[list[str], str|None]:
+        '''Gets saved posts newer than the cursor, excluding the passed collection.
+        Returns them with the new cursor, which the caller stores once the posts are kept.'''
         self.__logger.debug("Reddit", "Checking Reddit for saved posts.")
         currently_saved_posts = []
-        if not excluded:
-            excluded = []
-        for submission in self.__reddit_client.user.me().saved(limit=1):
+        if excluded is None:
+            excluded = set()
+        newest_post_id = None
+        for submission in self.__reddit_client.user.me().saved(limit=None):
             post_id = str(submission)
+            if newest_post_id is None:
+                newest_post_id = post_id
+            if post_id == cursor:
+                self.__logger.debug("Reddit", f"Reached previously synced post {cursor}, stopping.")
+                break
             if post_id not in excluded:
                 currently_saved_posts.append(post_id)
         self.__logger.info("Reddit", f"Obtained {len(currently_saved_posts)} new posts from Reddit.")
-        return currently_saved_posts
+        return currently_saved_posts, newest_post_id or cursor
 
-class TelegramHelper:
-    def __init__(self, logger:LoggingHelper, requester:RequestsHelper) -> None:
+class HostHandler:
+    '''Solver for the posts of a host, with the policies its requests should run under.
+    The pattern narrows which URLs of the host it takes and rewrite adjusts the URL before solving.'''
+    def __init__(self, name:str, solver:typing.Callable, pattern:str|None=None, rewrite:typing.Callable[[str], str]|None=None, retry_policy:RetryPolicy|None=None, rate:tuple[float, int]|None=None, cache:bool=True) -> None:
+        self.name = name
+        self.solver = solver
+        self.pattern = re.compile(pattern) if pattern else None
+        self.rewrite = rewrite
+        self.retry_policy = retry_policy
+        self.rate = rate
+        self.cache = cache
+
+class HostRegistry:
+    '''Dispatches post links to HostHandlers by hostname, parent domains included.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, cache:MediaCache|None, fallback:HostHandler) -> None:
+        '''Requires existing LoggingHelper and RequestsHelper objects, the MediaCache is optional.'''
         self.__logger = logger
         self.__requester = requester
+        self.__cache = cache
+        self.__fallback = fallback
+        self.__handlers = HostMap()
+
+    def register(self, hosts:list[str], handler:HostHandler) -> None:
+        '''Registers a handler once for its hosts and applies its request policies to them.'''
+        for host in hosts:
+            self.__handlers[host.lower()] = handler
+            if handler.retry_policy is not None:
+                self.__requester.set_retry_policy(host, handler.retry_policy, "GET")
+            if handler.rate is not None:
+                self.__requester.set_host_limit(host, *handler.rate)
+            if handler.cache and self.__cache is not None:
+                self.__cache.allow(host)
+
+    def resolve(self, resource_url:str) -> tuple[HostHandler, str]:
+        '''Returns the handler for a URL along with the URL as the handler wants it.'''
+        handler = self.__handlers.lookup(resource_url)
+        if handler is None or (handler.pattern is not None and not handler.pattern.search(resource_url)):
+            handler = self.__fallback
+        self.__logger.debug("Telegram", f"URL dispatched to {handler.name} handler.")
+        return handler, handler.rewrite(resource_url) if handler.rewrite else resource_url
+
+class Router:
+    '''Decides which Telegram chats and Discord webhooks a post goes to.
+    Every post goes to TELEGRAM_CHAT_ID and its group's webhook, ROUTES rules matching
+    the post's subreddit, author or group add destinations on top. Duplicates and failures
+    only reach webhooks routed by group:duplicate or group:failed.'''
+    FIELDS = ("subreddit", "author", "group")
+
+    def __init__(self, logger:LoggingHelper, routes:list[tuple[str, str, list[str]]]=ROUTES, default_chat:str|int=TELEGRAM_CHAT_ID) -> None:
+        self.__logger = logger
+        self.__default_chat = str(default_chat)
+        self.__webhooks = {
+            "photo":PHOTOS_WEBHOOK, "animation":ANIMATIONS_WEBHOOK, "video":VIDEOS_WEBHOOK, "audio":AUDIO_WEBHOOK,
+            "document":DOCUMENTS_WEBHOOK, "message":MESSAGES_WEBHOOK, "group":GROUP_WEBHOOK, "metadata":METADATA_WEBHOOK,
+            "duplicate":DUPLICATES_WEBHOOK, "failed":FAILED_WEBHOOK
+        }
+        self.__rules = []
+        for field, value, destinations in routes:
+            if field not in self.FIELDS:
+                self.__logger.error("Router", f"Ignoring route on unknown field: {field}")
+                continue
+            self.__rules.append((field, self.__normalize(value), destinations))
+        self.all_chats = self.__unique([self.__default_chat, *(item for _, _, destinations in self.__rules for item in destinations if not self.__is_webhook(item))])
+        if self.__rules:
+            self.__logger.info("Router", f"Loaded {len(self.__rules)} routes over {len(self.all_chats)} Telegram chats.")
+
+    def __normalize(self, value:str|None) -> str|None:
+        # r/pics, pics and R/Pics name the same subreddit, likewise u/ for authors.
+        if value is None:
+            return None
+        value = value.strip().lower()
+        return value[2:] if value[:2] in ("r/", "u/") else value
+
+    def __is_webhook(self, destination:str) -> bool:
+        return destination.startswith("http")
+
+    def __unique(self, destinations:list[str]) -> list[str]:
+        return list(dict.fromkeys(destinations))
+
+    def __matching(self, subreddit:str|None, author:str|None, group:str|None, fields:tuple[str, ...]=FIELDS) -> list[str]:
+        attributes = {"subreddit":self.__normalize(subreddit), "author":self.__normalize(author), "group":group}
+        destinations = []
+        for field, value, rule_destinations in self.__rules:
+            if field not in fields:
+                continue
+            # An unknown group matches every group rule, giving every chat the post might go to.
+            if (field == "group" and group is None) or value in ("*", attributes[field]):
+                destinations.extend(rule_destinations)
+        return destinations
+
+    def chats(self, subreddit:str|None, author:str|None, group:str|None=None) -> list[str]:
+        '''Telegram chats a post goes to, TELEGRAM_CHAT_ID first.'''
+        return self.__unique([self.__default_chat, *(item for item in self.__matching(subreddit, author, group) if not self.__is_webhook(item))])
+
+    def webhooks(self, subreddit:str|None, author:str|None, group:str) -> list[str]:
+        '''Discord webhooks notified of a post's outcome group, the group's own webhook first.'''
+        default = [self.__webhooks[group]] if group in self.__webhooks else []
+        fields = ("group",) if group in ("duplicate", "failed") else self.FIELDS
+        return self.__unique([*default, *(item for item in self.__matching(subreddit, author, group, fields) if self.__is_webhook(item))])
+
+class TelegramRequest:
+    '''One Bot API call and the files it delivers, sent as is by either engine.'''
+    def __init__(self, api_url:str, data:dict, files:dict|None=None, cost:int=1, group:str="", file_list:list|None=None, media_types:list[str]|None=None, reused:bool=False) -> None:
+        self.api_url = api_url
+        self.data = data
+        self.files = files
+        self.cost = cost
+        self.group = group
+        self.file_list = file_list or []
+        # Media type each file went out as, their file_ids are recorded under it.
+        self.media_types = media_types or []
+        self.reused = reused
+
+class TelegramApi:
+    '''Builds Bot API requests for one chat and keeps its dedup hashes, the requests go out on either engine.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, hashes:HashStore, file_ids:FileIdStore|None=None, chat_id:str|int=TELEGRAM_CHAT_ID) -> None:
+        self.__logger = logger
+        self.__hashes = hashes
+        self.__file_ids = file_ids
+        self.__chat_id = chat_id
         self.__image_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
         self.__animation_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendAnimation"
         self.__video_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendVideo"
@@ -352,60 +1837,71 @@ class TelegramHelper:
         self.__document_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument"
         self.__media_group_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMediaGroup"
         self.__message_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-
-        self.__hash_dict = None
-        self.__init_hash_dict()
-
-    def __init_hash_dict(self):
-        if os.path.isfile("hashes.txt") is False:
-            with open("hashes.txt", "w", encoding="utf-16") as _:
-                self.__logger.info("Worker", f"Created new hashes.txt successfully.")
-        else:
-            self.__logger.info("Worker", f"hashes.txt already exists locally, using local copy.")
-
-        with open("hashes.txt", "r", encoding="utf-16") as input_file:
-            self.__hash_dict = {hash:post_id for post_id, hash in [item.strip().split(':') for item in input_file.readlines()]}
-
-    def __hash_dict_to_file(self):
-        with open("hashes.txt", "w", encoding="utf-16") as output_file:
-            for hash, post_id in self.__hash_dict.items():
-                output_file.write(post_id+":"+hash+"\n")
-            self.__logger.info("Telegram", "hashes.txt updated.")
+        # Bot-wide limit plus the tighter per-chat one, every send waits on both.
+        self.limits = ["telegram", f"telegram:{chat_id}"]
+        requester.limit("telegram", TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        requester.limit(f"telegram:{chat_id}", TELEGRAM_CHAT_RATE/60, TELEGRAM_CHAT_RATE)
 
     def __check_hash(self, hash:str):
-        if hash not in self.__hash_dict:
+        solved_at = self.__hashes.get(hash)
+        if solved_at is None:
             self.__logger.info("Telegram", "Hash not found, unique post.")
             return True
         else:
-            self.__logger.info("Telegram", f"Post previously solved at {self.__hash_dict[hash]}, ignoring post.")
+            self.__logger.info("Telegram", f"Post previously solved at {solved_at}, ignoring post.")
             return False
 
-    def __update_hashes(self, hash_list:list[str], post_id:str):
-        for hash in hash_list:
-            self.__hash_dict[hash] = post_id
-        self.__hash_dict_to_file()
+    def delivered(self, request:TelegramRequest, post_id:str, payload:typing.Any=None) -> None:
+        '''Records the hashes and URLs of a successfully sent request.
+        With the parsed response, the file_ids of the sent media are kept for reuse.'''
+        self.__hashes.add([file.hash for file in request.file_list], post_id)
+        for file in request.file_list:
+            self.__hashes.add_urls([file.url], file.hash)
+        self.__logger.info("Telegram", "Hash store updated.")
+        if self.__file_ids is None or not isinstance(payload, dict):
+            return
+        result = payload.get("result")
+        # A media group answers with one message per item, in the order they were sent.
+        messages = result if isinstance(result, list) else [result]
+        entries = []
+        for file, media_type, message in zip(request.file_list, request.media_types, messages):
+            sent = self.__sent_file(message, media_type)
+            if sent is not None:
+                entries.append((file.hash, media_type, *sent))
+        if entries:
+            self.__file_ids.add(entries)
+            self.__logger.debug("Telegram", f"Stored {len(entries)} file_ids for reuse.")
 
-    def __get_base_message_from_post_details(self, post_details:list[str]) -> list[str]:
-        base_message = []
-        if post_details[0] is not None:
-            base_message.append(f"Post ID: {post_details[0]}")
-        if post_details[1] is not None:
-            base_message.append(f"{post_details[1]}")
-        if post_details[2] is not None:
-            base_message.append(f"by {post_details[2]}")
-        if post_details[3] is not None:
-            base_message.append(f"via {post_details[3]}")
-        if len(post_details) > 4 and post_details[4] is not None and post_details[4].startswith("http"):
-            base_message.append(f"Primary URL: {post_details[4]}")
-        self.__logger.info("Telegram", "Obtained base caption.")
-        return base_message
+    def __sent_file(self, message:typing.Any, media_type:str) -> tuple[str, str]|None:
+        if not isinstance(message, dict):
+            return None
+        media = message.get(media_type)
+        if isinstance(media, list):
+            # Photos come back as a list of sizes, the original is the largest and last.
+            media = media[-1] if media else None
+        if not isinstance(media, dict) or "file_id" not in media or "file_unique_id" not in media:
+            return None
+        return media["file_id"], media["file_unique_id"]
 
-    def __send_single(self, file:File, caption:str, post_id:str) -> tuple[bool, str]:
-        api_url = None
-        params = None
+    def __file_id(self, file:File, media_type:str) -> str|None:
+        if self.__file_ids is None:
+            return None
+        return self.__file_ids.get(file.hash, media_type)
+
+    def forget(self, request:TelegramRequest) -> None:
+        '''Drops the file_ids a failed request reused, the next attempt uploads the media again.'''
+        if self.__file_ids is None:
+            return
+        for file, media_type in zip(request.file_list, request.media_types):
+            self.__file_ids.forget(file.hash, media_type)
+        self.__logger.info("Telegram", "Reused file_ids rejected, uploading the media instead.")
+
+    def single(self, file:File, caption:str, reuse:bool=True) -> tuple[TelegramRequest|None, str]:
+        '''Request sending one file, or None and the failure group when it must not be sent.
+        Media uploaded before is sent by its file_id unless reuse is off.'''
         if file.file_headers:
             if self.__check_hash(file.hash):
-                params = {'chat_id':TELEGRAM_CHAT_ID, 'caption':caption}
+                params = {'chat_id':self.__chat_id, 'caption':caption}
                 if file.group == "photo":
                     api_url = self.__image_api_url
                     self.__logger.info("Telegram", "File sent as photo.")
@@ -421,233 +1917,463 @@ class TelegramHelper:
                 else:
                     api_url = self.__document_api_url
                     self.__logger.info("Telegram", "File sent as document.")
-                post_response = self.__requester.post(api_url=api_url, files=file.file_headers, data=params)
-                if post_response:
-                    self.__update_hashes([file.hash], post_id)
-                    return True, file.group
-                else:
-                    return False, "failed"
+                file_id = self.__file_id(file, file.group) if reuse else None
+                if file_id is not None:
+                    self.__logger.info("Telegram", "Media uploaded before, sending its file_id.")
+                    params[file.group] = file_id
+                    return TelegramRequest(api_url, params, group=file.group, file_list=[file], media_types=[file.group], reused=True), file.group
+                return TelegramRequest(api_url, params, files=file.file_headers, group=file.group, file_list=[file], media_types=[file.group]), file.group
             else:
-                return False, "duplicate"
+                return None, "duplicate"
         else:
             if file.exists:
                 if self.__check_hash(file.hash):
-                    params = {'chat_id':TELEGRAM_CHAT_ID, 'text':caption}
-                    api_url = self.__message_api_url
+                    params = {'chat_id':self.__chat_id, 'text':caption}
                     self.__logger.info("Telegram", "File exceeds 50 MB, sent as message.")
-                    post_response = self.__requester.post(api_url=api_url, data=params)
-                    if post_response:
-                        self.__update_hashes([file.hash], post_id)
-                        return True, "message"
-                    else:
-                        return False, "failed"
+                    return TelegramRequest(self.__message_api_url, params, group="message", file_list=[file]), "message"
                 else:
-                    return False, "duplicate"
+                    return None, "duplicate"
             else:
                 self.__logger.info("Telegram", "File does not exist.")
-                return False, "failed"
+                return None, "failed"
 
-    def __send_group(self, file_list:list[File], caption_list:list[str], post_id:str) -> tuple[bool, str]:
+    def group(self, file_list:list[File], caption_list:list[str], reuse:bool=True) -> TelegramRequest:
         media_types = [file.group for file in file_list]
         if "document" in media_types:
             media_types = ["document" for file in file_list]
         media_group = []
-        file_bytes = {}
+        file_streams = {}
+        reused = False
         for ix, file in enumerate(file_list):
-            media_group.append({"type":media_types[ix], "media":f"attach://{file.name}", "caption":caption_list[ix]})
-            file_bytes[file.name] = file.bytes
+            file_id = self.__file_id(file, media_types[ix]) if reuse else None
+            if file_id is not None:
+                media_group.append({"type":media_types[ix], "media":file_id, "caption":caption_list[ix]})
+                reused = True
+                continue
+            # Attach names are per position, two items both named image.jpg stay two parts.
+            attach_name = f"file{ix}"
+            media_group.append({"type":media_types[ix], "media":f"attach://{attach_name}", "caption":caption_list[ix]})
+            file_streams[attach_name] = (file.name, file.stream, file.mime_type)
         media_group = json.dumps(media_group)
-        params = {"chat_id":TELEGRAM_CHAT_ID, "media":media_group}
-        api_url = self.__media_group_api_url
+        params = {"chat_id":self.__chat_id, "media":media_group}
         self.__logger.info("Telegram", "Files sent as media group.")
-        post_response = self.__requester.post(api_url=api_url, files=file_bytes, data=params)
-        if post_response:
-            self.__update_hashes([file.hash for file in file_list], post_id)
-            return True, "group"
-        else:
-            return False, "failed"
+        if reused:
+            self.__logger.info("Telegram", f"{len(file_list) - len(file_streams)}/{len(file_list)} items uploaded before, sending their file_ids.")
+        return TelegramRequest(self.__media_group_api_url, params, files=file_streams or None, cost=len(file_list), group="group", file_list=file_list, media_types=media_types, reused=reused)
 
-    def __send_media(self, file_list:list[File], caption_list:list, post_id:str) -> tuple[bool, str]:
+    def media(self, file_list:list[File], caption_list:list, reuse:bool=True) -> tuple[TelegramRequest|None, str]:
         if len(caption_list) > 1:
-            return self.__send_group(file_list, caption_list, post_id)
+            return self.group(file_list, caption_list, reuse), "group"
         else:
-            return self.__send_single(file_list[0], caption_list[0], post_id)
+            return self.single(file_list[0], caption_list[0], reuse)
+
+    def message(self, text:str) -> TelegramRequest:
+        return TelegramRequest(self.__message_api_url, {'chat_id':self.__chat_id, 'text':text}, group="message")
+
+class TelegramDestination:
+    '''One chat posts are delivered to, with its own dedup hashes, checkpoints and rate limit.
+    The default chat keeps the unscoped state, so its history from before routing carries over.'''
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, database:Database, chat_id:str, file_ids:FileIdStore, scoped:bool=True) -> None:
+        scope = chat_id if scoped else None
+        self.chat_id = chat_id
+        self.hashes = HashStore(logger, database, scope)
+        self.progress = ProgressStore(logger, database, scope)
+        self.api = TelegramApi(logger, requester, self.hashes, file_ids, chat_id)
+
+class TelegramHelper:
+    REDGIFS_CONTENT_RE = re.compile(r'https:\/\/[a-z0-9]+.(redgifs|gfycat).com\/[a-zA-Z-]*.mp4')
+
+    def __init__(self, logger:LoggingHelper, requester:RequestsHelper, database:Database, router:Router|None=None, engine:AsyncEngine|None=None) -> None:
+        '''Requires existing LoggingHelper, RequestsHelper and Database objects.
+        With an AsyncEngine, media downloads, page loads and sends run on its event loop instead of threads.'''
+        self.__logger = logger
+        self.__requester = requester
+        self.__router = router or Router(self.__logger)
+        file_ids = FileIdStore(self.__logger, database)
+        self.__destinations = {
+            chat_id:TelegramDestination(self.__logger, self.__requester, database, chat_id, file_ids, scoped=(ix > 0))
+            for ix, chat_id in enumerate(self.__router.all_chats)
+        }
+        self.__destinations[self.__router.all_chats[0]].hashes.migrate_text_file()
+        self.__fanout = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self.__destinations)-1, 1), thread_name_prefix="fanout")
+        self.__engine = engine
+        self.__resolved = ResolveCache(self.__logger, database)
+        self.__normalizer = ImageNormalizer(self.__logger) if IMAGE_NORMALIZE else None
+        self.__videos = RedditVideoResolver(self.__logger, self.__requester, self.__engine)
+        self.__downloads = concurrent.futures.ThreadPoolExecutor(max_workers=MEDIA_DOWNLOADS, thread_name_prefix="media")
+        self.__cache = MediaCache(self.__logger, self.__requester, database) if MEDIA_CACHE_SIZE > 0 else None
+        self.__hosts = HostRegistry(self.__logger, self.__requester, self.__cache, HostHandler("others", self.__solve_others, cache=False))
+        # Gallery and RTF items are served from preview.redd.it, registering it is what caches them.
+        self.__hosts.register(["i.redd.it", "preview.redd.it"], HostHandler("reddit image", self.__solve_reddit_image))
+        self.__hosts.register(["v.redd.it"], HostHandler("reddit video", self.__solve_reddit_video))
+        self.__hosts.register(["reddit.com"], HostHandler("reddit gallery", self.__solve_reddit_gallery, pattern=r"reddit\.com/gallery/"))
+        self.__hosts.register(["imgur.com"], HostHandler("imgur", self.__solve_imgur, rewrite=lambda url: url.replace(".gifv",".mp4").replace(".gif",".mp4"), rate=(IMGUR_RATE, 10)))
+        self.__hosts.register(["redgifs.com", "gfycat.com"], HostHandler("redgifs/gfycat", self.__solve_redgifs_gfycat, rate=(REDGIFS_RATE, 5)))
+
+    def __download_files(self, url_list:list[str], errors:list[str]) -> list[File|None]:
+        '''Downloads files concurrently, results keep the order of url_list.
+        An item that raises, or that the engine already failed to fetch, comes back as None without affecting the others.
+        Failed downloads append their class to errors.'''
+        if self.__engine is not None:
+            downloads = self.__engine.run(self.__engine.requester.download_many(url_list, self.__cache, errors))
+            return list(self.__downloads.map(lambda url, download: self.__download_file(url, errors, download) if download is not None else None, url_list, downloads))
+        return list(self.__downloads.map(lambda url: self.__download_file(url, errors), url_list))
+
+    def __download_one(self, url:str, errors:list[str]) -> File|None:
+        return self.__download_files([url], errors)[0]
+
+    def __page_text(self, page_url:str) -> str|None:
+        if self.__engine is not None:
+            return self.__engine.run(self.__engine.requester.page_text(page_url))
+        return self.__requester.page_text(page_url)
+
+    def __download_file(self, url:str, errors:list[str], download:Download|None=None) -> File|None:
+        try:
+            return File(url, self.__logger, self.__requester, self.__cache, self.__normalizer, download, errors)
+        except Exception as error:
+            self.__logger.error("Telegram", error)
+            self.__logger.error("Telegram", f"Failure preparing file from URL: {url}")
+            return None
+
+    def __get_base_message(self, post:Post, primary_link:str|None=None) -> list[str]:
+        base_message = []
+        if post.id is not None:
+            base_message.append(f"Post ID: {post.id}")
+        if post.title is not None:
+            base_message.append(f"{post.title}")
+        if post.author is not None:
+            base_message.append(f"by {post.author}")
+        if post.subreddit is not None:
+            base_message.append(f"via {post.subreddit}")
+        if primary_link is not None and primary_link.startswith("http"):
+            base_message.append(f"Primary URL: {primary_link}")
+        self.__logger.info("Telegram", "Obtained base caption.")
+        return base_message
+
+    def __send_media(self, destination:TelegramDestination, file_list:list[File], caption_list:list, post_id:str, errors:list[str]) -> tuple[bool, str]:
+        '''Sends one media request to the chat, appending the class of a failed send to errors.
+        A rejected file_id is not a failure of its own, only the upload that replaces it counts.'''
+        request, group = destination.api.media(file_list, caption_list)
+        if request is None:
+            return False, group
+        send_errors = []
+        sent, payload = self.__post(destination, request, send_errors)
+        if not sent and request.reused:
+            destination.api.forget(request)
+            request, group = destination.api.media(file_list, caption_list, reuse=False)
+            send_errors = []
+            sent, payload = self.__post(destination, request, send_errors)
+        if sent:
+            destination.api.delivered(request, post_id, payload)
+            return True, request.group
+        else:
+            errors.extend(send_errors)
+            return False, "failed"
+
+    def __post(self, destination:TelegramDestination, request:TelegramRequest, errors:list[str]|None=None) -> tuple[bool, typing.Any]:
+        '''Sends a request on the configured engine, returns whether it went through and the parsed response.
+        Uploads hold the locks of their files, two chats never stream one payload at once.
+        The body is built and its file handles rewound only here, under those locks.'''
+        with contextlib.ExitStack() as uploads:
+            if request.files:
+                for file in request.file_list:
+                    uploads.enter_context(file.upload_lock)
+            if self.__engine is not None:
+                body = self.__engine.run(self.__engine.requester.post(api_url=request.api_url, files=request.files, data=request.data, limits=destination.api.limits, cost=request.cost, errors=errors))
+                if body is None:
+                    return False, None
+                try:
+                    return True, json.loads(body)
+                except ValueError:
+                    return True, None
+            post_response = self.__requester.post(api_url=request.api_url, files=request.files, data=request.data, limits=destination.api.limits, cost=request.cost, errors=errors)
+            if not post_response:
+                return False, None
+            try:
+                return True, post_response.json()
+            except ValueError:
+                return True, None
 
     def __fix_json_text(self, escaped_text:str) -> str:
-        return html.unescape(escaped_text.encode("utf-16", "surrogatepass").decode("utf-16"))
+        return escaped_text.encode("utf-16", "surrogatepass").decode("utf-16")
+
+    def __targets(self, delivery:Delivery) -> list[TelegramDestination]:
+        return [self.__destinations[chat_id] for chat_id in self.__router.chats(delivery.subreddit, delivery.author, delivery.group)]
+
+    def __known_url(self, delivery:Delivery, url:str) -> bool:
+        '''Marks the delivery a duplicate when the URL already led to delivered media in every chat it goes to.'''
+        solved = [destination.hashes.get_url(url) for destination in self.__targets(delivery)]
+        if None in solved:
+            return False
+        solved_at = solved[0]
+        self.__logger.info("Telegram", f"URL previously solved at {solved_at}, skipping download.")
+        delivery.duplicate_of = solved_at
+        return True
 
-    def __solve_reddit_image(self, post_details:list) -> tuple[bool, str]:
+    def __solve_reddit_image(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post falls under Reddit-hosted images.")
-        base_message = self.__get_base_message_from_post_details(post_details)
-        file = File(post_details[4], self.__logger, self.__requester)
+        delivery = Delivery(post)
+        if self.__known_url(delivery, post.primary_link):
+            return delivery
+        base_message = self.__get_base_message(post, post.primary_link)
+        file = self.__download_one(post.primary_link, delivery.errors)
+        if file is None:
+            return delivery
         caption = "\n".join(base_message)
-        return self.__send_media([file], [caption], post_details[0])
+        delivery.add([file], [caption])
+        return delivery
 
-    def __solve_reddit_video(self, post_details:list) -> tuple[bool, str]:
+    def __solve_reddit_video(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post falls under Reddit-hosted videos.")
-        base_message = self.__get_base_message_from_post_details(post_details)
-        json_data = self.__requester.load_json(f"https://www.reddit.com/comments/{post_details[0]}.json")
-        parent_post_data = dict(json_data[0]["data"]["children"][0]["data"])
-        candidate_video_url = self.__fix_json_text(parent_post_data["media"]["reddit_video"]["fallback_url"])
-        candidate_audio_url = candidate_video_url.split("DASH_")[0] + "DASH_audio.mp4"
+        delivery = Delivery(post)
+        delivery.aliases.append(post.primary_link)
+        if self.__known_url(delivery, post.primary_link):
+            return delivery
+        base_message = self.__get_base_message(post, post.primary_link)
+        reddit_video = post.data["media"]["reddit_video"]
+        fallback_url = self.__fix_json_text(reddit_video["fallback_url"])
+        manifest_url = self.__fix_json_text(reddit_video.get("dash_url") or fallback_url.split("DASH_")[0] + "DASHPlaylist.mpd")
+        candidate_video_url, candidate_audio_url = self.__videos.resolve(manifest_url, fallback_url)
+        if self.__known_url(delivery, candidate_video_url):
+            return delivery
         message_extension = []
-        video_file = File(candidate_video_url, self.__logger, self.__requester)
-        audio_file = File(candidate_audio_url, self.__logger, self.__requester)
+        video_file = self.__download_one(candidate_video_url, delivery.errors)
+        if video_file is None:
+            return delivery
         if video_file.exists:
             message_extension.append(f"Video URL: {candidate_video_url}")
-        if audio_file.exists:
+        if candidate_audio_url is not None:
             message_extension.append(f"Audio URL: {candidate_audio_url}")
         base_message.extend(message_extension)
         caption = "\n".join(base_message)
-        return self.__send_media([video_file], [caption], post_details[0])
+        delivery.add([video_file], [caption])
+        return delivery
 
-    def __solve_reddit_gallery(self, post_details:list) -> tuple[bool, str]:
+    def __solve_reddit_gallery(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post falls under Reddit-hosted gallery.")
-        base_message = self.__get_base_message_from_post_details(post_details)
-        json_data = self.__requester.load_json(f"https://www.reddit.com/comments/{post_details[0]}.json")
-        parent_post_data = dict(json_data[0]["data"]["children"][0]["data"])
+        delivery = Delivery(post, "group")
+        base_message = self.__get_base_message(post, post.primary_link)
+        parent_post_data = post.data
         if parent_post_data["is_gallery"] is True and parent_post_data["media_metadata"] is not None:
             image_dict = parent_post_data["media_metadata"]
+            image_links = self.__undelivered(delivery, [self.__fix_json_text(image_dict[key]["s"]["u"]) for key in image_dict])
             file_list = []
             caption_list = []
-            for key in image_dict:
-                image_link = self.__fix_json_text(image_dict[key]["s"]["u"])
-                file_list.append(File(image_link, self.__logger, self.__requester))
-                caption_list.append("\n".join(base_message + [f"Image URL: {image_link}"]))
-            if file_list:
-                send_status = []
-                groups, max_group_length = self.__split_group(file_list)
-                for div in range(int(groups)):
-                    div_range = range(div*max_group_length, min((div+1)*max_group_length, len(file_list)))
-                    current_file_group = [file_list[ix] for ix in div_range]
-                    current_caption_group = [caption_list[ix] for ix in div_range]
-                    send_status.append(self.__send_media(current_file_group, current_caption_group, post_details[0])[0])
-                if False not in send_status:
-                    return True, "group"
+            for image_link, file in zip(image_links, self.__download_files(image_links, delivery.errors)):
+                if file is not None and file.exists:
+                    file_list.append(file)
+                    caption_list.append("\n".join(base_message + [f"Image URL: {image_link}"]))
                 else:
-                    return False, "failed"
-            else:
-                return False, "failed"
-        else:
-            return False, "failed"
-
-    def __split_group(self, file_list:list[File]) -> tuple[int, int]:
-        self.__logger.info("Telegram", f"Total files to send: {len(file_list)}")
-        total_size = sum([len(file.bytes) for file in file_list]) / (1024*1024)
-        self.__logger.info("Telegram", f"Total size of files in MBs: {total_size}")
+                    # Left without a checkpoint, the post fails and its retry downloads the item again.
+                    delivery.missing += 1
+            if delivery.missing:
+                self.__logger.error("Telegram", f"{delivery.missing}/{len(image_links)} gallery items could not be downloaded.")
+            if file_list:
+                # Items left without a complete payload go out alone, as a message carrying their URL.
+                sizes = [file.size for file in file_list]
+                solo = [file.file_headers is None for file in file_list]
+                self.__logger.info("Telegram", f"Total files to send: {len(sizes)}")
+                self.__logger.info("Telegram", f"Total size of files in MBs: {sum(sizes) / (1024*1024)}")
+                groups = self.plan_groups(sizes, GALLERY_KEEP_ORDER, solo)
+                self.__logger.info("Telegram", f"Planned {len(groups)} groups of sizes {[len(group) for group in groups]}.")
+                for group in groups:
+                    delivery.add([file_list[ix] for ix in group], [caption_list[ix] for ix in group])
+        return delivery
 
-        groups = 1
-        while int(math.ceil(len(file_list)/float(groups))) > 10.0:
-            groups += 1
-        self.__logger.debug("Telegram", f"Groups: {groups}, files per group less than 10, partial conditions met.")
-        self.__logger.debug("Telegram", "Checking if total size of each individual group satisfies limits.")
-        while True:
-            self.__logger.debug("Telegram", f"Checking for groups: {groups}.")
-            max_group_length = int(math.ceil(len(file_list)/float(groups)))
-            max_group_size = 0
-            for div in range(groups):
-                current_group = [file_list[ix] for ix in range(div*max_group_length, min((div+1)*max_group_length, len(file_list)))]
-                max_group_size = max(max_group_size, sum([len(file.bytes) for file in current_group]) / (1024*1024))
-            self.__logger.debug("Telegram", f"Maximum group size at groups: {groups} is {max_group_size}.")
-            if max_group_size > 50.0:
-                groups += 1
-            else:
-                self.__logger.debug("Telegram", "Group-wise sizes within limits, all conditions met.")
-                break
-        self.__logger.info("Telegram", f"Maximum group of length {max_group_length} posts suitable.")
-        return groups, max_group_length
+    @staticmethod
+    def plan_groups(sizes:list[int], keep_order:bool=GALLERY_KEEP_ORDER, solo:list[bool]|None=None) -> list[list[int]]:
+        '''Packs item indices into media groups of at most MEDIA_GROUP_LIMIT items and FIFTY_MB in total.
+        In order, greedy next-fit gives the fewest contiguous groups. Otherwise first-fit decreasing
+        fills gaps left by large items. An item over the size limit, or flagged in solo, gets a group of its own.'''
+        solo = solo or [False] * len(sizes)
+        groups = []
+        if keep_order:
+            group_size = 0
+            for ix, size in enumerate(sizes):
+                if not groups or solo[ix] or solo[groups[-1][-1]] or len(groups[-1]) >= MEDIA_GROUP_LIMIT or group_size + size > FIFTY_MB:
+                    groups.append([])
+                    group_size = 0
+                groups[-1].append(ix)
+                group_size += size
+        else:
+            group_sizes = []
+            for ix in sorted(range(len(sizes)), key=lambda ix: sizes[ix], reverse=True):
+                for gx, group in enumerate(groups):
+                    if not solo[ix] and not solo[group[0]] and len(group) < MEDIA_GROUP_LIMIT and group_sizes[gx] + sizes[ix] <= FIFTY_MB:
+                        group.append(ix)
+                        group_sizes[gx] += sizes[ix]
+                        break
+                else:
+                    groups.append([ix])
+                    group_sizes.append(sizes[ix])
+            for group in groups:
+                group.sort()
+            groups.sort()
+        return groups
 
-    def __solve_imgur(self, post_details:list) -> tuple[bool, str]:
+    def __solve_imgur(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post falls under Imgur-hosted media.")
-        base_message = self.__get_base_message_from_post_details(post_details)
-        file = File(post_details[4], self.__logger, self.__requester)
+        delivery = Delivery(post)
+        if self.__known_url(delivery, post.primary_link):
+            return delivery
+        base_message = self.__get_base_message(post, post.primary_link)
+        file = self.__download_one(post.primary_link, delivery.errors)
+        if file is None:
+            return delivery
         caption = "\n".join(base_message)
-        return self.__send_media([file], [caption], post_details[0])
+        delivery.add([file], [caption])
+        return delivery
 
-    def __solve_redgifs_gfycat(self, post_details:list) -> tuple[bool, str]:
+    def __solve_redgifs_gfycat(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post falls under Redgifs/Gfycat-hosted media.")
-        base_message = self.__get_base_message_from_post_details(post_details)
-        CONTENT_RE = re.compile(r'https:\/\/[a-z0-9]+.(redgifs|gfycat).com\/[a-zA-Z-]*.mp4')
-        page_text = self.__requester.page_text(post_details[4])
+        delivery = Delivery(post)
+        delivery.aliases.append(post.primary_link)
+        if self.__known_url(delivery, post.primary_link):
+            return delivery
+        base_message = self.__get_base_message(post, post.primary_link)
         try:
-            media_link = re.search(CONTENT_RE, page_text).group(0)
-            file = File(media_link, self.__logger, self.__requester)
+            media_link = self.__resolved.get(post.primary_link)
+            if media_link is None:
+                page_text = self.__page_text(post.primary_link)
+                media_link = self.REDGIFS_CONTENT_RE.search(page_text).group(0)
+                self.__resolved.put(post.primary_link, media_link)
+            if self.__known_url(delivery, media_link):
+                return delivery
+            file = self.__download_one(media_link, delivery.errors)
+            if file is None:
+                return delivery
             caption = "\n".join(base_message + [f"Media URL: {media_link}"])
-            return self.__send_media([file], [caption], post_details[0])
+            delivery.add([file], [caption])
         except:
-            return False, "failed"
+            self.__logger.error("Telegram", "Media link not found on page.")
+        return delivery
 
-    def __solve_others(self, post_details:list) -> tuple[bool, str]:
+    def __solve_others(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post doesn't fall under any known category.")
-        base_message = self.__get_base_message_from_post_details(post_details)
-        file = File(post_details[4], self.__logger, self.__requester)
+        delivery = Delivery(post)
+        if self.__known_url(delivery, post.primary_link):
+            return delivery
+        base_message = self.__get_base_message(post, post.primary_link)
+        file = self.__download_one(post.primary_link, delivery.errors)
+        if file is None:
+            return delivery
         caption = "\n".join(base_message)
-        return self.__send_media([file], [caption], post_details[0])
+        delivery.add([file], [caption])
+        return delivery
 
-    def __media_metadata_solver(self, post_details:list) -> tuple[bool, str]:
+    def __media_metadata_solver(self, post:Post) -> Delivery:
         self.__logger.info("Telegram", "Post falls under RTF Media.")
-        base_details = post_details[:4]
-        json_data = self.__requester.load_json(f"https://www.reddit.com/comments/{post_details[0]}.json")
-        parent_post_data = dict(json_data[0]["data"]["children"][0]["data"])
-        send_status = []
+        delivery = Delivery(post, "metadata")
+        parent_post_data = post.data
+        items = []
         for file_id in parent_post_data["media_metadata"]:
             file_data = parent_post_data["media_metadata"][file_id]
             if file_data["status"] == "valid" and file_data["e"] == "Image":
-                media_link = self.__fix_json_text(file_data["s"]["u"])
-                file_details = [*base_details, media_link]
-                file_message = self.__get_base_message_from_post_details(file_details)
-                file = File(media_link, self.__logger, self.__requester)
-                caption = "\n".join(file_message)
-                send_status.append(self.__send_single(file, caption, post_details[0])[0])
+                items.append((self.__fix_json_text(file_data["s"]["u"]), False, None))
             elif file_data["status"] == "valid" and file_data["e"] == "AnimatedImage":
-                media_link = self.__fix_json_text(file_data["s"]["gif"])
-                file_details = [*base_details, media_link]
-                file_message = self.__get_base_message_from_post_details(file_details)
-                file = File(media_link, self.__logger, self.__requester)
-                caption = "\n".join(file_message)
-                send_status.append(self.__send_single(file, caption, post_details[0])[0])
+                items.append((self.__fix_json_text(file_data["s"]["gif"]), False, None))
             elif file_data["status"] == "valid" and file_data["e"] == "RedditVideo":
                 video_height = file_data["y"]
-                candidate_video_url = f"https://v.redd.it/{file_id}/DASH_{video_height}.mp4"
-                candidate_audio_url = f"https://v.redd.it/{file_id}/DASH_audio.mp4"
+                fallback_url = f"https://v.redd.it/{file_id}/DASH_{video_height}.mp4"
+                items.append((fallback_url, True, f"https://v.redd.it/{file_id}/DASHPlaylist.mpd"))
+            else:
+                self.__logger.debug("Telegram", "Unknown kind, unable to solve.")
+        undelivered = self.__undelivered(delivery, [media_link for media_link, _, _ in items])
+        items = [item for item in items if item[0] in undelivered]
+        # Videos settle on a rendition first, then every item is fetched through the pool.
+        resolved = []
+        for media_link, is_video, manifest_url in items:
+            if is_video:
+                video_url, audio_url = self.__videos.resolve(manifest_url, media_link)
+                resolved.append((media_link, video_url, is_video, audio_url))
+            else:
+                resolved.append((media_link, media_link, is_video, None))
+        urls = [url for _, url, _, _ in resolved]
+        files = dict(zip(urls, self.__download_files(urls, delivery.errors)))
+        for media_link, url, is_video, candidate_audio_url in resolved:
+            file = files[url]
+            if file is None:
+                continue
+            if not is_video:
+                file_message = self.__get_base_message(post, media_link)
+            else:
                 message_extension = []
-                video_file = File(candidate_video_url, self.__logger, self.__requester)
-                audio_file = File(candidate_audio_url, self.__logger, self.__requester)
-                if video_file.exists:
-                    message_extension.append(f"Video URL: {candidate_video_url}")
-                if audio_file.exists:
+                if file.exists:
+                    message_extension.append(f"Video URL: {url}")
+                if candidate_audio_url is not None:
                     message_extension.append(f"Audio URL: {candidate_audio_url}")
-                file_message = self.__get_base_message_from_post_details(base_details)
+                file_message = self.__get_base_message(post)
                 file_message.extend(message_extension)
-                caption = "\n".join(file_message)
-                send_status.append(self.__send_media([video_file], [caption], post_details[0])[0])
-            else:
-                self.__logger.debug("Telegram", "Unknown kind, unable to solve.")
-        if True in send_status:
-            return True, "metadata"
-        else:
-            return False, "failed"
+            caption = "\n".join(file_message)
+            delivery.add([file], [caption], [media_link])
+        return delivery
 
-    def solve_post(self, post_details:list[str]) -> tuple[bool, str]:
+    def solve_post(self, post:Post) -> tuple[bool, str]:
         '''Solves post given post details.'''
-        if post_details[4] != "media_metadata_not_null":
+        return self.deliver(self.prepare_post(post))
+
+    def deliver(self, delivery:Delivery) -> tuple[bool, str]:
+        '''Sends the media of a prepared post to every chat it is routed to, dedup checks happen right before each send.
+        The first chat goes alone and uploads, the others follow in parallel and mostly reuse its file_ids.
+        A post fails if any chat failed and is a duplicate only when every chat already had it.'''
+        if delivery.duplicate_of is not None:
+            return False, "duplicate"
+        first, *others = self.__targets(delivery)
+        outcomes = [self.__deliver_to(first, delivery), *self.__fanout.map(lambda destination: self.__deliver_to(destination, delivery), others)]
+        if others:
+            self.__logger.info("Telegram", f"Delivered to {len(outcomes)} chats: {', '.join(f'{destination.chat_id}={group}' for destination, (_, group) in zip([first, *others], outcomes))}")
+        if any(not status and group != "duplicate" for status, group in outcomes):
+            return False, "failed"
+        outcome = next(((status, group) for status, group in outcomes if status), (False, "duplicate"))
+        if outcome[0]:
+            # Checkpoints go only once every chat has the post, a retry skips the chats that were done.
+            for destination in [first, *others]:
+                destination.progress.clear(delivery.post_id)
+        return outcome
+
+    def __deliver_to(self, destination:TelegramDestination, delivery:Delivery) -> tuple[bool, str]:
+        '''Sends what the chat does not have yet, every successful send is checkpointed so a retry only sends what is missing.'''
+        delivered = destination.progress.delivered(delivery.post_id)
+        skipped = delivery.skipped
+        results = []
+        for file_list, caption_list, item_list in delivery.sends:
+            if delivered.issuperset(item_list):
+                skipped += len(item_list)
+                continue
+            status, group = self.__send_media(destination, file_list, caption_list, delivery.post_id, delivery.errors)
+            if status:
+                destination.progress.record(delivery.post_id, item_list)
+            results.append((status, group))
+        if delivery.missing:
+            outcome = (False, "failed")
+        elif not results:
+            outcome = (True, delivery.group or delivery.kind) if skipped else (False, "failed")
+        elif delivery.kind == "group":
+            outcome = (True, "group") if all(status for status, _ in results) else (False, "failed")
+        elif delivery.kind == "metadata":
+            outcome = (True, "metadata") if skipped or any(status for status, _ in results) else (False, "failed")
+        else:
+            outcome = results[0]
+        if outcome[0] and delivery.aliases and delivery.sends:
+            destination.hashes.add_urls(delivery.aliases, delivery.sends[0][0][0].hash)
+        return outcome
+
+    def __undelivered(self, delivery:Delivery, url_list:list[str]) -> list[str]:
+        '''Drops items an earlier attempt at the post already delivered to every chat, counting them as skipped.'''
+        delivered = set.intersection(*(destination.progress.delivered(delivery.post_id) for destination in self.__targets(delivery)))
+        undelivered = [url for url in url_list if url not in delivered]
+        delivery.skipped = len(url_list) - len(undelivered)
+        if delivery.skipped:
+            self.__logger.info("Telegram", f"Resuming post, {delivery.skipped}/{len(url_list)} items already delivered.")
+        return undelivered
+
+    def prepare_post(self, post:Post) -> Delivery:
+        '''Resolves and downloads the media of a post without sending anything.'''
+        if post.primary_link != "media_metadata_not_null":
             self.__logger.info("Telegram", "Single link solvable, proceeding using primary link.")
-            domain, post_details[4] = self.__requester.check_domain(post_details[4])
-            if domain == "REDDIT_IMAGE":
-                return self.__solve_reddit_image(post_details)
-            elif domain == "REDDIT_VIDEO":
-                return self.__solve_reddit_video(post_details)
-            elif domain == "REDDIT_GALLERY":
-                return self.__solve_reddit_gallery(post_details)
-            elif domain == "IMGUR":
-                return self.__solve_imgur(post_details)
-            elif domain == "REDGIFS":
-                return self.__solve_redgifs_gfycat(post_details)
-            elif domain == "GFYCAT":
-                return self.__solve_redgifs_gfycat(post_details)
-            else:
-                return self.__solve_others(post_details)
+            handler, post.primary_link = self.__hosts.resolve(post.primary_link)
+            return handler.solver(post)
         else:
             self.__logger.info("Telegram", "Primary link unavailable.")
             self.__logger.info("Telegram", "Media metadata not null, proceeding with that.")
-            return self.__media_metadata_solver(post_details)
\ No newline at end of file
+            return self.__media_metadata_solver(post)
\ No newline at end of file
@@ -22,7 +22,6 @@ REDDIT_USERNAME = str(os.environ.get("REDDIT_USERNAME"))
 REDDIT_PASSWORD = str(os.environ.get("REDDIT_PASSWORD"))
 TELEGRAM_BOT_TOKEN = str(os.environ.get("TELEGRAM_BOT_TOKEN"))
 TELEGRAM_CHAT_ID = int(os.environ.get("TELEGRAM_CHAT_ID"))
-SLEEP_BETWEEN_POSTS = int(os.environ.get("SLEEP_BETWEEN_POSTS"))
 IDLE_SLEEP = int(os.environ.get("IDLE_SLEEP"))
 SLEEP_ON_FAILED_GET = int(os.environ.get("SLEEP_ON_FAILED_GET"))
 GET_ATTEMPTS = int(os.environ.get("GET_ATTEMPTS"))
@@ -33,6 +32,66 @@ REFRESH_AFTER_POSTS = int(os.environ.get("REFRESH_AFTER_POSTS"))
 # Global constants
 TEN_MB = int(10*1024*1024)
 FIFTY_MB = int(50*1024*1024)
+MIME_SNIFF_BYTES = int(8*1024)
+INFO_BATCH_SIZE = 100
+MEDIA_GROUP_LIMIT = 10
+DISCORD_CONTENT_LIMIT = 2000
+PHOTO_MAX_SIDE = 1280
+PHOTO_MIMES = ["image/jpeg", "image/png", "image/webp"]
+ANIM_MIMES = ["image/gif"]
+VIDEO_MIMES = ["video/mp4", "video/x-m4v"]
+AUDIO_MIMES = ["audio/mpeg"]
+REMOVED_MEDIA_URLS = ["https://i.imgur.com/removed.png", "https://imgur.com/removed.png"]
 REQUEST_HEADERS = {
     "User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.5005.63 Safari/537.36"
-}
\ No newline at end of file
+}
+
+# Optional environment variables
+DOWNLOAD_SIZE_CAP = int(os.environ.get("DOWNLOAD_SIZE_CAP", FIFTY_MB))
+DOWNLOAD_SPOOL_SIZE = int(os.environ.get("DOWNLOAD_SPOOL_SIZE", TEN_MB))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 64*1024))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_KEEP_ALIVE = str(os.environ.get("HTTP_KEEP_ALIVE", "true")).lower() in ["1", "true", "yes"]
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 30))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 60))
+REDDIT_JSON_TTL = int(os.environ.get("REDDIT_JSON_TTL", 300))
+PREFETCH_POSTS = int(os.environ.get("PREFETCH_POSTS", 100))
+PREFETCH_TTL = int(os.environ.get("PREFETCH_TTL", 3600))
+STATE_DATABASE = str(os.environ.get("STATE_DATABASE", "rescrapper.db"))
+PIPELINE_DOWNLOADS = int(os.environ.get("PIPELINE_DOWNLOADS", 1))
+MEDIA_DOWNLOADS = int(os.environ.get("MEDIA_DOWNLOADS", 4))
+SLEEP_BETWEEN_POSTS = int(os.environ.get("SLEEP_BETWEEN_POSTS", 0))
+TELEGRAM_GLOBAL_RATE = int(os.environ.get("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = int(os.environ.get("TELEGRAM_CHAT_RATE", 20))
+DISCORD_WEBHOOK_RATE = int(os.environ.get("DISCORD_WEBHOOK_RATE", 30))
+DISCORD_WEBHOOK_BURST = int(os.environ.get("DISCORD_WEBHOOK_BURST", 5))
+RETRY_MAX_DELAY = int(os.environ.get("RETRY_MAX_DELAY", 60))
+# Per-host overrides as host=attempts:base_delay:max_delay, comma separated.
+RETRY_POLICIES = {
+    host.strip():tuple(float(value) for value in policy.split(":"))
+    for host, policy in [item.split("=") for item in str(os.environ.get("RETRY_POLICIES", "")).split(",") if "=" in item]
+}
+RETRY_POST_ATTEMPTS = int(os.environ.get("RETRY_POST_ATTEMPTS", 5))
+RETRY_POST_DELAY = int(os.environ.get("RETRY_POST_DELAY", 1800))
+MEDIA_CACHE_DIR = str(os.environ.get("MEDIA_CACHE_DIR", "media_cache"))
+MEDIA_CACHE_SIZE = int(os.environ.get("MEDIA_CACHE_SIZE", 1024*1024*1024))
+GALLERY_KEEP_ORDER = str(os.environ.get("GALLERY_KEEP_ORDER", "true")).lower() in ["1", "true", "yes"]
+DASH_SIZE_MARGIN = float(os.environ.get("DASH_SIZE_MARGIN", 0.9))
+IMGUR_RATE = float(os.environ.get("IMGUR_RATE", 1))
+REDGIFS_RATE = float(os.environ.get("REDGIFS_RATE", 1))
+RESOLVE_TTL = int(os.environ.get("RESOLVE_TTL", 7*24*3600))
+IMAGE_NORMALIZE = str(os.environ.get("IMAGE_NORMALIZE", "false")).lower() in ["1", "true", "yes"]
+IMAGE_NORMALIZE_FORMAT = str(os.environ.get("IMAGE_NORMALIZE_FORMAT", "JPEG")).upper()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+DISCORD_FLUSH_INTERVAL = int(os.environ.get("DISCORD_FLUSH_INTERVAL", 10))
+ASYNC_ENGINE = str(os.environ.get("ASYNC_ENGINE", "false")).lower() in ["1", "true", "yes"]
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get("ASYNC_MAX_IN_FLIGHT", 1000))
+ASYNC_HOST_CONNECTIONS = int(os.environ.get("ASYNC_HOST_CONNECTIONS", 100))
+# Extra destinations as field:value=destination;destination, comma separated. Fields are subreddit, author
+# and group, destinations are Telegram chat ids or Discord webhook URLs.
+ROUTES = [
+    (match.split(":", 1)[0].strip().lower(), match.split(":", 1)[1].strip(), [item.strip() for item in destinations.split(";") if item.strip()])
+    for match, destinations in [rule.split("=", 1) for rule in str(os.environ.get("ROUTES", "")).split(",") if "=" in rule]
+    if ":" in match
+]
@@ -0,0 +1,10 @@
+import os
+
+# load_variables reads these at import time, any value will do for the tests.
+for name, value in {
+    "TELEGRAM_CHAT_ID":"-100", "IDLE_SLEEP":"1", "SLEEP_ON_FAILED_GET":"0", "GET_ATTEMPTS":"1",
+    "SLEEP_ON_FAILED_POST":"0", "POST_ATTEMPTS":"1", "REFRESH_AFTER_POSTS":"5",
+    "REDDIT_USER_AGENT":"ReScrapper tests", "REDDIT_CLIENT_ID":"client", "REDDIT_CLIENT_SECRET":"secret",
+    "REDDIT_USERNAME":"user", "REDDIT_PASSWORD":"password"
+}.items():
+    os.environ.setdefault(name, value)
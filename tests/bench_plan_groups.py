@@ -0,0 +1,58 @@
+'''Micro-benchmark of TelegramHelper.plan_groups over synthetic gallery size distributions.
+Compares the ordered and first-fit decreasing plans with the equal-length split they replaced.
+Run with: python -m tests.bench_plan_groups'''
+import math
+import random
+import time
+
+from helpers import *
+
+MB = 1024*1024
+GALLERIES = 20
+
+DISTRIBUTIONS = {
+    "20 phone photos of 3-12 MB":lambda rng: [rng.randint(3*MB, 12*MB) for _ in range(20)],
+    "100 phone photos of 3-12 MB":lambda rng: [rng.randint(3*MB, 12*MB) for _ in range(100)],
+    "100 x 1-2 MB with one 45 MB item":lambda rng: [rng.randint(1*MB, 2*MB) for _ in range(99)] + [45*MB],
+    "50 photos and GIFs, lognormal sizes":lambda rng: [min(int(rng.lognormvariate(15, 1.2)), 49*MB) for _ in range(50)],
+    "500 lognormal sizes":lambda rng: [min(int(rng.lognormvariate(15, 1.5)), 49*MB) for _ in range(500)],
+}
+
+def equal_split(sizes:list[int]) -> list[list[int]]:
+    '''The split used before plan_groups: the fewest equal-length contiguous groups that fit the limits.'''
+    groups = math.ceil(len(sizes) / MEDIA_GROUP_LIMIT)
+    while True:
+        length = math.ceil(len(sizes) / groups)
+        split = [list(range(start, min(start + length, len(sizes)))) for start in range(0, len(sizes), length)]
+        if length == 1 or max(sum(sizes[ix] for ix in group) for group in split) <= FIFTY_MB:
+            return split
+        groups += 1
+
+PLANS = {
+    "equal split":equal_split,
+    "ordered":lambda sizes: TelegramHelper.plan_groups(sizes, keep_order=True),
+    "first-fit decreasing":lambda sizes: TelegramHelper.plan_groups(sizes, keep_order=False),
+}
+
+def measure(plan:typing.Callable, galleries:list[list[int]], repeat:int=5) -> tuple[float, float]:
+    '''Average groups per gallery and the best average time per plan in milliseconds.'''
+    groups = sum(len(plan(sizes)) for sizes in galleries) / len(galleries)
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for sizes in galleries:
+            plan(sizes)
+        best = min(best, (time.perf_counter() - start) / len(galleries))
+    return groups, best * 1000
+
+def main() -> None:
+    rng = random.Random(16)
+    print(f"{'distribution':<38}{'plan':<22}{'groups':>8}{'ms/plan':>10}")
+    for name, distribution in DISTRIBUTIONS.items():
+        galleries = [distribution(rng) for _ in range(GALLERIES)]
+        for plan_name, plan in PLANS.items():
+            groups, milliseconds = measure(plan, galleries)
+            print(f"{name:<38}{plan_name:<22}{groups:>8.1f}{milliseconds:>10.3f}")
+
+if __name__ == "__main__":
+    main()
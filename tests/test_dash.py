@@ -0,0 +1,71 @@
+import os
+import unittest
+import unittest.mock
+
+from helpers import *
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+MANIFEST_URL = "https://v.redd.it/abc123/DASHPlaylist.mpd"
+
+def fixture(name:str) -> str:
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as input_file:
+        return input_file.read()
+
+class RedditVideoResolverTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.requester = unittest.mock.Mock(spec=RequestsHelper)
+        self.resolver = RedditVideoResolver(unittest.mock.Mock(), self.requester)
+
+    def renditions(self, name:str) -> list[tuple[str, str, int, int, int]]:
+        return [
+            (rendition.kind, rendition.url, rendition.bandwidth, rendition.height, rendition.estimated_size)
+            for rendition in self.resolver.parse(fixture(name), MANIFEST_URL)
+        ]
+
+    def test_parse_content_type_manifest(self) -> None:
+        # 1 minute 30.5 seconds, sizes are bandwidth / 8 * 90.5.
+        self.assertEqual(self.renditions("dash_content_type.mpd"), [
+            ("video", "https://v.redd.it/abc123/DASH_360.mp4", 800000, 360, 9050000),
+            ("video", "https://v.redd.it/abc123/DASH_720.mp4", 2500000, 720, 28281250),
+            ("video", "https://v.redd.it/abc123/DASH_1080.mp4", 5000000, 1080, 56562500),
+            ("audio", "https://v.redd.it/abc123/DASH_AUDIO_128.mp4", 128000, 0, 1448000),
+            ("audio", "https://v.redd.it/abc123/DASH_AUDIO_64.mp4", 64000, 0, 724000)
+        ])
+
+    def test_parse_mime_type_only_manifest(self) -> None:
+        # Video sets mimeType per Representation, audio on its AdaptationSet, 0 hours 0 minutes 45 seconds.
+        self.assertEqual(self.renditions("dash_mime_type.mpd"), [
+            ("video", "https://v.redd.it/abc123/DASH_240", 400000, 240, 2250000),
+            ("video", "https://v.redd.it/abc123/DASH_480", 1200000, 480, 6750000),
+            ("audio", "https://v.redd.it/abc123/audio", 64000, 0, 360000)
+        ])
+
+    def test_parse_rejects_broken_manifest(self) -> None:
+        self.assertEqual(self.resolver.parse("<MPD", MANIFEST_URL), [])
+
+    def test_unknown_duration_estimates_nothing(self) -> None:
+        manifest_text = fixture("dash_mime_type.mpd").replace('mediaPresentationDuration="PT0H0M45.000S"', 'mediaPresentationDuration="P1D"')
+        self.assertEqual({rendition.estimated_size for rendition in self.resolver.parse(manifest_text, MANIFEST_URL)}, {0})
+
+    def resolve(self, name:str, budget:int) -> tuple[str, str|None]:
+        self.requester.page_text.return_value = fixture(name)
+        return self.resolver.resolve(MANIFEST_URL, "https://v.redd.it/abc123/DASH_720.mp4?source=fallback", budget)
+
+    def test_resolve_picks_highest_rendition_within_budget(self) -> None:
+        # 50 MB at the default margin leaves 47.19 MB, minus 1.45 MB for the best audio: 1080p is over, 720p fits.
+        self.assertEqual(self.resolve("dash_content_type.mpd", FIFTY_MB), ("https://v.redd.it/abc123/DASH_720.mp4", "https://v.redd.it/abc123/DASH_AUDIO_128.mp4"))
+        self.assertEqual(self.resolve("dash_content_type.mpd", 2*FIFTY_MB), ("https://v.redd.it/abc123/DASH_1080.mp4", "https://v.redd.it/abc123/DASH_AUDIO_128.mp4"))
+        self.assertEqual(self.resolve("dash_mime_type.mpd", TEN_MB), ("https://v.redd.it/abc123/DASH_480", "https://v.redd.it/abc123/audio"))
+        self.requester.probe.assert_not_called()
+
+    def test_resolve_falls_back_to_smallest_rendition(self) -> None:
+        self.assertEqual(self.resolve("dash_content_type.mpd", 5*1024*1024), ("https://v.redd.it/abc123/DASH_360.mp4", "https://v.redd.it/abc123/DASH_AUDIO_128.mp4"))
+
+    def test_resolve_without_manifest_probes_fallback_audio(self) -> None:
+        self.requester.page_text.return_value = None
+        self.requester.probe.return_value = False
+        self.assertEqual(self.resolver.resolve(MANIFEST_URL, "https://v.redd.it/abc123/DASH_720.mp4?source=fallback"), ("https://v.redd.it/abc123/DASH_720.mp4?source=fallback", None))
+        self.requester.probe.assert_called_once_with("https://v.redd.it/abc123/DASH_audio.mp4")
+
+if __name__ == "__main__":
+    unittest.main()
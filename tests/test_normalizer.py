@@ -0,0 +1,67 @@
+import io
+import unittest
+import unittest.mock
+
+import PIL.features
+import PIL.Image
+
+from helpers import *
+
+def encoded(image:PIL.Image.Image, format:str, **options) -> io.BytesIO:
+    output_file = io.BytesIO()
+    image.save(output_file, format, **options)
+    output_file.seek(0)
+    return output_file
+
+def half_transparent() -> PIL.Image.Image:
+    '''Wider than PHOTO_MAX_SIDE, transparent on the left half and opaque red on the right.'''
+    image = PIL.Image.new("RGBA", (PHOTO_MAX_SIDE * 2, 200), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (PHOTO_MAX_SIDE, 0, PHOTO_MAX_SIDE * 2, 200))
+    return image
+
+WEBP = PIL.features.check("webp")
+
+class ImageNormalizerTest(unittest.TestCase):
+    def normalize(self, source:io.BytesIO, format:str) -> PIL.Image.Image:
+        normalized = ImageNormalizer(unittest.mock.Mock(), format).normalize(source)
+        self.assertIsNotNone(normalized)
+        output_file, size, dimensions = normalized
+        self.assertEqual(dimensions, (PHOTO_MAX_SIDE, 100))
+        data = output_file.read()
+        self.assertEqual(len(data), size)
+        return PIL.Image.open(io.BytesIO(data))
+
+    def assertClose(self, pixel:tuple, expected:tuple) -> None:
+        self.assertTrue(all(abs(value - reference) <= 8 for value, reference in zip(pixel, expected)), f"{pixel} is not close to {expected}")
+
+    def test_jpeg_puts_transparent_png_on_white(self) -> None:
+        image = self.normalize(encoded(half_transparent(), "PNG"), "JPEG")
+        self.assertEqual((image.format, image.mode), ("JPEG", "RGB"))
+        self.assertClose(image.getpixel((10, 50)), (255, 255, 255))
+        self.assertClose(image.getpixel((PHOTO_MAX_SIDE - 10, 50)), (255, 0, 0))
+
+    def test_jpeg_puts_palette_transparency_on_white(self) -> None:
+        palette = half_transparent().convert("RGB").quantize(2)
+        transparent_index = palette.getpixel((10, 50))
+        image = self.normalize(encoded(palette, "PNG", transparency=transparent_index), "JPEG")
+        self.assertClose(image.getpixel((10, 50)), (255, 255, 255))
+
+    @unittest.skipUnless(WEBP, "Pillow built without WebP")
+    def test_jpeg_puts_transparent_webp_on_white(self) -> None:
+        image = self.normalize(encoded(half_transparent(), "WEBP", lossless=True), "JPEG")
+        self.assertClose(image.getpixel((10, 50)), (255, 255, 255))
+
+    @unittest.skipUnless(WEBP, "Pillow built without WebP")
+    def test_webp_keeps_alpha(self) -> None:
+        image = self.normalize(encoded(half_transparent(), "PNG"), "WEBP")
+        self.assertEqual((image.format, image.mode), ("WEBP", "RGBA"))
+        self.assertEqual(image.getpixel((10, 50))[3], 0)
+        self.assertEqual(image.getpixel((PHOTO_MAX_SIDE - 10, 50))[3], 255)
+
+    def test_opaque_images_stay_rgb(self) -> None:
+        image = self.normalize(encoded(half_transparent().convert("RGB"), "PNG"), "JPEG")
+        self.assertEqual(image.mode, "RGB")
+        self.assertClose(image.getpixel((10, 50)), (0, 0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
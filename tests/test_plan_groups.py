@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from helpers import *
+
+MB = 1024*1024
+
+class PlanGroupsTest(unittest.TestCase):
+    def assertValidPlan(self, sizes:list[int], groups:list[list[int]], solo:list[bool]|None=None) -> None:
+        self.assertEqual(sorted(ix for group in groups for ix in group), list(range(len(sizes))))
+        for group in groups:
+            if len(group) > 1:
+                self.assertLessEqual(len(group), MEDIA_GROUP_LIMIT)
+                self.assertLessEqual(sum(sizes[ix] for ix in group), FIFTY_MB)
+                self.assertFalse(any((solo or [False] * len(sizes))[ix] for ix in group))
+
+    def test_ordered_splits_on_item_limit(self) -> None:
+        groups = TelegramHelper.plan_groups([MB] * 12, keep_order=True)
+        self.assertEqual(groups, [list(range(10)), [10, 11]])
+
+    def test_ordered_keeps_groups_contiguous(self) -> None:
+        groups = TelegramHelper.plan_groups([30*MB, 30*MB, 10*MB, 20*MB], keep_order=True)
+        self.assertEqual(groups, [[0], [1, 2], [3]])
+
+    def test_first_fit_decreasing_fills_gaps(self) -> None:
+        groups = TelegramHelper.plan_groups([30*MB, 30*MB, 10*MB, 20*MB], keep_order=False)
+        self.assertEqual(groups, [[0, 3], [1, 2]])
+
+    def test_item_over_the_limit_goes_alone(self) -> None:
+        sizes = [MB, 60*MB, MB, MB]
+        self.assertEqual(TelegramHelper.plan_groups(sizes, keep_order=True), [[0], [1], [2, 3]])
+        self.assertEqual(TelegramHelper.plan_groups(sizes, keep_order=False), [[0, 2, 3], [1]])
+
+    def test_single_item_over_the_limit(self) -> None:
+        for keep_order in [True, False]:
+            self.assertEqual(TelegramHelper.plan_groups([60*MB], keep_order=keep_order), [[0]])
+
+    def test_solo_items_go_alone(self) -> None:
+        solo = [False, True, False]
+        self.assertEqual(TelegramHelper.plan_groups([MB] * 3, keep_order=True, solo=solo), [[0], [1], [2]])
+        self.assertEqual(TelegramHelper.plan_groups([MB] * 3, keep_order=False, solo=solo), [[0, 2], [1]])
+
+    def test_random_plans_are_valid(self) -> None:
+        rng = random.Random(0)
+        for _ in range(200):
+            sizes = [int(rng.lognormvariate(15, 1.5)) for _ in range(rng.randint(1, 40))]
+            solo = [rng.random() < 0.1 for _ in sizes]
+            for keep_order in [True, False]:
+                self.assertValidPlan(sizes, TelegramHelper.plan_groups(sizes, keep_order, solo), solo)
+
+if __name__ == "__main__":
+    unittest.main()
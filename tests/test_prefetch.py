@@ -0,0 +1,124 @@
+import functools
+import http.server
+import json
+import threading
+import unittest
+import unittest.mock
+import urllib.parse
+
+from helpers import *
+
+class RedditStandIn(http.server.BaseHTTPRequestHandler):
+    '''Answers the token and /api/info endpoints praw uses, knowing only the posts in POSTS.'''
+    POSTS = {}
+    info_requests = []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def __reply(self, status:int, payload:dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.__reply(200, {"access_token":"token", "token_type":"bearer", "expires_in":3600, "scope":"*"})
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        if url.path.startswith("/comments/") and url.path.endswith(".json"):
+            post_id = url.path[len("/comments/"):-len(".json")]
+            self.__reply(200, [{"kind":"Listing", "data":{"children":[{"kind":"t3", "data":self.POSTS[post_id]}]}}])
+            return
+        if url.path.rstrip("/") != "/api/info":
+            self.__reply(404, {"error":404})
+            return
+        query = urllib.parse.parse_qs(url.query)
+        fullnames = query["id"][0].split(",")
+        type(self).info_requests.append(fullnames)
+        if query.get("raw_json") != ["1"]:
+            self.__reply(400, {"error":400})
+            return
+        if "t3_forbidden" in fullnames:
+            self.__reply(403, {"error":403})
+            return
+        children = [{"kind":"t3", "data":self.POSTS[fullname[3:]]} for fullname in fullnames if fullname[3:] in self.POSTS]
+        self.__reply(200, {"kind":"Listing", "data":{"children":children, "after":None, "before":None}})
+
+def post_data(post_id:str) -> dict:
+    '''Post data as served with raw_json=1, where text is no longer HTML-escaped.'''
+    return {
+        "id":post_id, "name":f"t3_{post_id}", "title":f"Writing &amp; &not; in {post_id}", "author":"someone",
+        "subreddit":"pics", "subreddit_name_prefixed":"r/pics", "url_overridden_by_dest":f"https://example.com/{post_id}?a=1&not=2&copy=3"
+    }
+
+class PrefetchPostDetailsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        RedditStandIn.POSTS = {post_id:post_data(post_id) for post_id in [f"p{ix}" for ix in range(150)]}
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RedditStandIn)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        # Keyword settings override praw.ini, pointing the client built by RedditHelper at the stand-in.
+        cls.client = unittest.mock.patch("praw.Reddit", functools.partial(praw.Reddit, oauth_url=base_url, reddit_url=base_url, check_for_updates=False))
+        cls.client.start()
+        cls.base_url = base_url
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.client.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        RedditStandIn.info_requests = []
+        self.requester = unittest.mock.Mock(spec=RequestsHelper)
+        self.reddit = RedditHelper(unittest.mock.Mock(), self.requester)
+
+    def test_batches_of_info_batch_size(self) -> None:
+        post_ids = [f"p{ix}" for ix in range(150)]
+        self.assertEqual(self.reddit.prefetch_post_details(post_ids), 150)
+        self.assertEqual([len(fullnames) for fullnames in RedditStandIn.info_requests], [INFO_BATCH_SIZE, 150 - INFO_BATCH_SIZE])
+
+    def test_prefetched_posts_skip_the_comments_json(self) -> None:
+        self.reddit.prefetch_post_details(["p1", "p2"])
+        post = self.reddit.get_post_details("p2")
+        self.requester.load_json.assert_not_called()
+        self.assertEqual((post.id, post.title, post.author, post.subreddit, post.primary_link), ("p2", "Writing &amp; &not; in p2", "u/someone", "r/pics", "https://example.com/p2?a=1&not=2&copy=3"))
+
+    def test_comments_json_is_read_in_the_same_shape(self) -> None:
+        self.requester.load_json.return_value = [{"data":{"children":[{"data":post_data("p3")}]}}]
+        post = self.reddit.get_post_details("p3")
+        self.requester.load_json.assert_called_once_with("https://www.reddit.com/comments/p3.json?raw_json=1")
+        self.assertEqual((post.title, post.primary_link), ("Writing &amp; &not; in p3", "https://example.com/p3?a=1&not=2&copy=3"))
+
+    def test_comments_json_loads_with_a_query(self) -> None:
+        json_url = f"{self.base_url}/comments/p4.json?raw_json=1"
+        requester = RequestsHelper(unittest.mock.Mock())
+        self.assertEqual(requester.load_json(json_url)[0]["data"]["children"][0]["data"]["title"], "Writing &amp; &not; in p4")
+        engine = AsyncEngine(unittest.mock.Mock(), requester)
+        try:
+            self.assertEqual(engine.run(engine.requester.load_json(json_url))[0]["data"]["children"][0]["data"]["id"], "p4")
+        finally:
+            engine.close()
+
+    def test_fresh_posts_are_not_requested_again(self) -> None:
+        self.reddit.prefetch_post_details(["p1", "p2"])
+        self.assertEqual(self.reddit.prefetch_post_details(["p1", "p2", "p3"]), 1)
+        self.assertEqual(RedditStandIn.info_requests, [["t3_p1", "t3_p2"], ["t3_p3"]])
+
+    def test_unknown_posts_are_left_to_the_comments_json(self) -> None:
+        self.requester.load_json.return_value = None
+        self.assertEqual(self.reddit.prefetch_post_details(["p1", "gone"]), 1)
+        self.assertIsNone(self.reddit.get_post_details("gone"))
+        self.requester.load_json.assert_called_once_with("https://www.reddit.com/comments/gone.json?raw_json=1")
+
+    def test_failed_batch_is_not_fatal(self) -> None:
+        self.assertEqual(self.reddit.prefetch_post_details(["forbidden", "p1"]), 0)
+
+if __name__ == "__main__":
+    unittest.main()
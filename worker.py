@@ -1,83 +1,78 @@
 from helpers import *
+import collections
+import concurrent.futures
 import itertools
 
 class Worker:
     def __init__(self, logger:LoggingHelper, requester:RequestsHelper) -> None:
         self.__logger = logger
         self.__requester = requester
-        self.__reddit = RedditHelper(self.__logger, self.__requester)
-        self.__telegram = TelegramHelper(self.__logger, self.__requester)
-        self.__discord = DiscordHelper(self.__logger)
-
-        self.__pending_posts = None
-        self.__processed_posts = None
-        self.__failed_posts = None
-        self.__init_local_files()
+        self.__database = Database(self.__logger)
+        # With the async engine, requests run on one event loop shared by the Reddit and Telegram helpers.
+        self.__engine = AsyncEngine(self.__logger, self.__requester) if ASYNC_ENGINE else None
+        self.__reddit = RedditHelper(self.__logger, self.__requester, self.__engine)
+        self.__router = Router(self.__logger)
+        self.__telegram = TelegramHelper(self.__logger, self.__requester, self.__database, self.__router, self.__engine)
+        self.__discord = DiscordHelper(self.__logger, self.__requester)
+
+        self.__posts = PostStore(self.__logger, self.__database)
+        self.__posts_until_prefetch = 0
+        self.__init_post_store()
         self.__refresh_pending_posts()
-        self.__retry_failed_posts()
 
-    def __init_local_files(self):
-        local_files = [
-            "pending_posts.txt",
-            "processed_posts.txt",
-            "failed_posts.txt"
-        ]
-        for file in local_files:
-            if os.path.isfile(file) is False:
-                with open(file, "w", encoding="utf-16") as _:
-                    self.__logger.info("Worker", f"Created new {file} successfully.")
-            else:
-                self.__logger.info("Worker", f"{file} already exists locally, using local copy.")
-        
-        with open("pending_posts.txt", "r", encoding="utf-16") as input_file:
-            self.__pending_posts = [item.strip() for item in input_file.readlines()]
-        with open("processed_posts.txt", "r", encoding="utf-16") as input_file:
-            self.__processed_posts = [item.strip() for item in input_file.readlines()]
-        with open("failed_posts.txt", "r", encoding="utf-16") as input_file:
-            self.__failed_posts = [item.strip() for item in input_file.readlines()]
-
-    def __refresh_pending_posts(self):
-        excluded = self.__pending_posts + self.__processed_posts + self.__failed_posts
-        new_posts = self.__reddit.get_saved_posts(excluded=excluded)
-        self.__pending_posts = [*new_posts, *self.__pending_posts]
-        self.__pending_posts = sorted(self.__pending_posts, reverse=True)
-        if not self.__pending_posts:
+    def __init_post_store(self):
+        self.__posts.migrate_text_files()
+        self.__posts.recover()
+        self.__logger.info("Worker", f"Post store ready with {self.__posts.count('pending')} pending, {self.__posts.count('processed')} processed, {self.__posts.count('failed')} failed and {self.__posts.count('dead')} dead posts.")
+
+    def __refresh_pending_posts(self, idle_sleep:bool=True):
+        new_posts, cursor = self.__reddit.get_saved_posts(excluded=self.__posts, cursor=self.__posts.saved_cursor())
+        self.__posts.add_pending(new_posts, cursor)
+        self.__retry_failed_posts()
+        if not self.__posts.count("pending") and not idle_sleep:
+            self.__logger.info("Worker", "No new posts to solve, continuing with the posts in flight.")
+        elif not self.__posts.count("pending"):
             self.__logger.info("Worker", f"No posts to solve, sleeping for {IDLE_SLEEP/60} minutes.")
             time.sleep(IDLE_SLEEP)
         elif new_posts:
-            self.__list_to_file(self.__pending_posts, "pending_posts.txt")
+            self.__posts_until_prefetch = 0
             self.__logger.info("Worker", "Pending posts updated.")
         else:
             self.__logger.info("Worker", "No new posts to solve, continuing with currently pending posts.")
 
     def __retry_failed_posts(self):
-        self.__logger.info("Worker", "Searching for old failed posts to retry.")
-        if self.__failed_posts:
-            self.__logger.info("Worker", "Failed posts found, queued for retyring.")
-            self.__pending_posts.extend(self.__failed_posts)
-            self.__failed_posts.clear()
-            self.__list_to_file(self.__failed_posts, "failed_posts.txt")
-            self.__pending_posts = list(set(self.__pending_posts))
-            self.__pending_posts = sorted(self.__pending_posts, reverse=True)
-            self.__list_to_file(self.__pending_posts, "pending_posts.txt")
+        self.__logger.info("Worker", "Searching for failed posts due for a retry.")
+        requeued = self.__posts.requeue_due()
+        if requeued:
+            self.__logger.info("Worker", f"{requeued} failed posts due, queued for retyring.")
         else:
-            self.__logger.info("Worker", "No failed posts found, continuing as usual.")
+            self.__logger.info("Worker", "No failed posts due, continuing as usual.")
 
-    def load_refresher(self):
+    def load_refresher(self, idle_sleep:bool=True):
+        '''Checks for new posts, idle_sleep off keeps it from sleeping while claimed posts still wait to be sent.'''
         self.__logger.info("Worker", "Periodic check for new posts if any.")
-        self.__refresh_pending_posts()
+        self.__logger.debug("Worker", f"HTTP connection stats: {self.__requester.connection_stats()}")
+        self.__logger.debug("Worker", f"HTTP retry stats: {self.__requester.retry_stats()}")
+        self.__refresh_pending_posts(idle_sleep)
 
-    def __list_to_file(self, list:list, file:str):
-        with open(file, "w", encoding="utf-16") as output_file:
-            output_file.write("\n".join(list))
+    def __prefetch_pending_posts(self):
+        # Post details for the next posts are fetched in bulk, refilled once half the window is used.
+        if PREFETCH_POSTS <= 0:
+            return
+        if self.__posts_until_prefetch > 0:
+            self.__posts_until_prefetch -= 1
+            return
+        self.__reddit.prefetch_post_details(self.__posts.upcoming(PREFETCH_POSTS))
+        self.__posts_until_prefetch = PREFETCH_POSTS // 2
 
     def __generator(self):
         while True:
-            if len(self.__pending_posts) != 0:
-                self.__logger.info("Worker", f"{len(self.__pending_posts)} posts remaining before refresh.")
-                unsaved_post = self.__pending_posts.pop()
+            pending = self.__posts.count("pending")
+            if pending != 0:
+                self.__logger.info("Worker", f"{pending} posts remaining before refresh.")
+                self.__prefetch_pending_posts()
+                unsaved_post = self.__posts.claim_next()
                 self.__logger.info("Worker", f"Popped post with id: {unsaved_post} from pending posts.")
-                self.__list_to_file(self.__pending_posts, "pending_posts.txt")
                 yield unsaved_post
             else:
                 self.__refresh_pending_posts()
@@ -85,45 +80,52 @@ class Worker:
     def get_unsolved_post(self):
         return self.__generator().__next__()
 
-    def solve_post(self, post_id:str):
-        post_details = self.__reddit.get_post_details(post_id)
+    def has_pending_posts(self) -> bool:
+        return self.__posts.count("pending") != 0
+
+    def __notify(self, webhook_url:str, post_id:str):
+        self.__discord.queue(webhook_url, post_id)
+
+    def prepare_post(self, post_id:str) -> Delivery|None:
+        '''Fetches post details and downloads its media, safe to run from a download thread.'''
+        post = self.__reddit.get_post_details(post_id)
         self.__logger.info("Worker", f"Started solving post with id: {post_id}")
-        if post_details:
-            status, group = self.__telegram.solve_post(post_details)
+        if post:
+            return self.__telegram.prepare_post(post)
+        else:
+            return None
+
+    def solve_post(self, post_id:str):
+        self.finish_post(post_id, self.prepare_post(post_id))
+
+    def finish_post(self, post_id:str, delivery:Delivery|None):
+        '''Sends a prepared post, notifies the webhooks it is routed to and records the outcome.'''
+        if delivery:
+            status, group = self.__telegram.deliver(delivery)
+            webhooks = self.__router.webhooks(delivery.subreddit, delivery.author, group)
             if status:
                 self.__logger.info("Worker", f"Success solving post with id: {post_id}")
-                if group == "photo":
-                    self.__discord.send(PHOTOS_WEBHOOK, post_id)
-                elif group == "animation":
-                    self.__discord.send(ANIMATIONS_WEBHOOK, post_id)
-                elif group == "video":
-                    self.__discord.send(VIDEOS_WEBHOOK, post_id)
-                elif group == "audio":
-                    self.__discord.send(AUDIO_WEBHOOK, post_id)
-                elif group == "document":
-                    self.__discord.send(DOCUMENTS_WEBHOOK, post_id)
-                elif group == "message":
-                    self.__discord.send(MESSAGES_WEBHOOK, post_id)
-                elif group == "group":
-                    self.__discord.send(GROUP_WEBHOOK, post_id)
-                elif group == "metadata":
-                    self.__discord.send(METADATA_WEBHOOK, post_id)
+                for webhook_url in webhooks:
+                    self.__notify(webhook_url, post_id)
                 self.__logger.info("Worker", f"Finished solving post with id: {post_id}")
-                self.__processed_posts.append(post_id)
-                self.__list_to_file(self.__processed_posts, "processed_posts.txt")
+                self.__posts.mark(post_id, "processed")
             else:
                 self.__logger.error("Worker", f"Failure solving post with id: {post_id}")
-                if group == "duplicate":
-                    self.__discord.send(DUPLICATES_WEBHOOK, post_id)
-                elif group == "failed":
-                    self.__discord.send(FAILED_WEBHOOK, post_id)
-                self.__failed_posts.append(post_id)
-                self.__list_to_file(self.__failed_posts, "failed_posts.txt")
+                for webhook_url in webhooks:
+                    self.__notify(webhook_url, post_id)
+                # A duplicate stays a duplicate and so does a 404, retrying either only wastes bandwidth.
+                error = delivery.error
+                self.__record_failure(post_id, f"{group}: {error}" if error else group, permanent=(group == "duplicate" or error == "permanent"))
         else:
             self.__logger.error("Worker", f"Failure solving post with id: {post_id}")
-            self.__discord.send(FAILED_WEBHOOK, post_id)
-            self.__failed_posts.append(post_id)
-            self.__list_to_file(self.__failed_posts, "failed_posts.txt")
+            for webhook_url in self.__router.webhooks(None, None, "failed"):
+                self.__notify(webhook_url, post_id)
+            self.__record_failure(post_id, "unsolvable")
+
+    def __record_failure(self, post_id:str, error:str, permanent:bool=False):
+        status = self.__posts.fail(post_id, error, permanent)
+        if status == "dead":
+            self.__logger.info("Worker", f"Post with id: {post_id} will not be retried, last error: {error}.")
 
 if __name__=="__main__":
     logger = LoggingHelper()
@@ -134,11 +136,24 @@ if __name__=="__main__":
         REFRESH_AFTER_POSTS = 5
         logger.info("Worker", "REFRESH_AFTER_POSTS < 5, setting to 5 to check after every 5 posts.")
 
+    if PIPELINE_DOWNLOADS > 1:
+        logger.info("Worker", f"Pipelined mode, downloading up to {PIPELINE_DOWNLOADS} posts ahead of the upload.")
+        downloads = concurrent.futures.ThreadPoolExecutor(max_workers=PIPELINE_DOWNLOADS, thread_name_prefix="download")
+        in_flight = collections.deque()
+
     for mod in itertools.cycle(range(REFRESH_AFTER_POSTS-1, -1, -1)):
-        unsolved_post = workerInstance.get_unsolved_post()
-        workerInstance.solve_post(unsolved_post)
-        time.sleep(SLEEP_BETWEEN_POSTS)
+        if PIPELINE_DOWNLOADS > 1:
+            # Posts are uploaded in the order they were claimed while the next ones download.
+            while len(in_flight) <= PIPELINE_DOWNLOADS and (not in_flight or workerInstance.has_pending_posts()):
+                unsolved_post = workerInstance.get_unsolved_post()
+                in_flight.append((unsolved_post, downloads.submit(workerInstance.prepare_post, unsolved_post)))
+            unsolved_post, prepared = in_flight.popleft()
+            workerInstance.finish_post(unsolved_post, prepared.result())
+        else:
+            unsolved_post = workerInstance.get_unsolved_post()
+            workerInstance.solve_post(unsolved_post)
+        if SLEEP_BETWEEN_POSTS > 0:
+            time.sleep(SLEEP_BETWEEN_POSTS)
         if mod == 0:
-            workerInstance.load_refresher()
-            logger.info("Worker", f"Sleeping for {3*SLEEP_BETWEEN_POSTS} seconds to allow manual stopping without errors.")
-            time.sleep(3*SLEEP_BETWEEN_POSTS)
\ No newline at end of file
+            # Downloaded posts still in flight are sent before any idle sleep.
+            workerInstance.load_refresher(idle_sleep=not (PIPELINE_DOWNLOADS > 1 and in_flight))
\ No newline at end of file